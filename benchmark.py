@@ -0,0 +1,41 @@
+from scheduling import Computer, Process
+from time import perf_counter
+import random
+
+#Measures the scheduler cost per dispatch with a growing backlog of queued processes.
+#The cost should stay flat from 1k to 100k queued processes.
+
+BACKLOGS = [1_000, 10_000, 100_000]
+DISPATCHES = 1_000
+
+
+class BenchmarkProcess(Process):
+    process_type:str = "benchmark"
+
+    def __init__(self, burst_time:int, priority:int):
+        super().__init__(None, priority)
+        self.burst_time = burst_time
+        self.original_burst_time = burst_time
+
+
+def fill(computer:Computer, backlog:int):
+    for _ in range(backlog):
+        computer.add_process(BenchmarkProcess(random.randint(1, 10_000), random.randint(1, 3)))
+
+
+def bench(backlog:int) -> float:
+    computer = Computer(settings={"max_in_flight":None})
+    computer.logger.disabled = True
+    fill(computer, backlog)
+
+    worker = computer.workers[0]
+    start = perf_counter()
+    for _ in range(DISPATCHES):
+        worker.current_process = None
+        computer.schedule(worker)
+    return (perf_counter() - start) / DISPATCHES
+
+
+if __name__ == "__main__":
+    for backlog in BACKLOGS:
+        print(f"{backlog:>7} queued: {bench(backlog) * 1_000_000:.2f} us per dispatch")
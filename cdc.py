@@ -0,0 +1,98 @@
+from typing import Iterator
+import hashlib
+import os
+
+#Content-defined chunking for delta uploads. Boundaries come from a gear rolling hash
+#over the content, so an edit only changes the chunks around it and every other chunk
+#keeps its hash. Chunks are stored once per user under chunks/<localId>/<sha256>.<version> and
+#a file becomes a small manifest listing them. Like content objects, the database counts the
+#manifests referencing each chunk and the chunk is deleted once none does.
+
+MIN_CHUNK = 16 * 1024
+AVERAGE_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+MANIFEST_VERSION = 1
+
+#One pseudo random 64 bit value per byte value, derived so every client cuts at the same places
+GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "big") for value in range(256)]
+MASK_64 = (1 << 64) - 1
+#Normalized chunking: a stricter mask before the average size and a looser one after it
+#keeps most chunks close to the average
+MASK_SMALL = (1 << (AVERAGE_CHUNK.bit_length() + 1)) - 1 << (64 - AVERAGE_CHUNK.bit_length() - 1)
+MASK_LARGE = (1 << (AVERAGE_CHUNK.bit_length() - 3)) - 1 << (64 - AVERAGE_CHUNK.bit_length() + 3)
+
+
+def cut_point(data, start:int, end:int) -> int:
+    #End of the chunk starting at start, the first MIN_CHUNK bytes are skipped since they can't be a boundary
+    if (end - start <= MIN_CHUNK):
+        return end
+    fingerprint = 0
+    position = start + MIN_CHUNK
+    normal = min(start + AVERAGE_CHUNK, end)
+    limit = min(start + MAX_CHUNK, end)
+    while (position < normal):
+        fingerprint = ((fingerprint << 1) + GEAR[data[position]]) & MASK_64
+        position += 1
+        if (not fingerprint & MASK_SMALL):
+            return position
+    while (position < limit):
+        fingerprint = ((fingerprint << 1) + GEAR[data[position]]) & MASK_64
+        position += 1
+        if (not fingerprint & MASK_LARGE):
+            return position
+    return limit
+
+
+def chunk_ranges(data) -> Iterator[tuple[int, int]]:
+    start = 0
+    while (start < len(data)):
+        end = cut_point(data, start, len(data))
+        yield start, end
+        start = end
+
+
+def manifest(data, digests:dict[str, str]=None) -> dict:
+    return {
+        "version":MANIFEST_VERSION,
+        "size":len(data),
+        "chunks":[[hashlib.sha256(data[start:end]).hexdigest(), end - start] for start, end in chunk_ranges(data)],
+        **(digests or {})
+    }
+
+
+class ChunkStore:
+    """Local copies of a user's chunks under CACHE_PATH/.cdc, so later downloads of this or
+    another file only fetch the chunks that are not here yet."""
+
+    def __init__(self, user_id:str):
+        self.root = f'{os.environ.get("CACHE_PATH")}/.cdc/chunks/{user_id}'
+
+    def path(self, digest:str) -> str:
+        return f"{self.root}/{digest[:2]}/{digest}"
+
+    def has(self, digest:str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put(self, digest:str, data) -> str:
+        path = self.path(digest)
+        if (not os.path.exists(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", 'wb') as f:
+                f.write(data)
+            os.replace(f"{path}.tmp", path)
+        return path
+
+    def get(self, digest:str) -> bytes:
+        #None when the local copy is missing or does not hash to its name
+        try:
+            with open(self.path(digest), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return data if (hashlib.sha256(data).hexdigest() == digest) else None
+
+    def remove(self, digest:str):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
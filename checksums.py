@@ -0,0 +1,52 @@
+from base64 import b64encode
+import google_crc32c
+import hashlib
+
+
+class StreamingDigest:
+    """CRC32C and MD5 of a transfer, fed with the bytes in file order as they move
+    so the file is never read a second time just to hash it."""
+
+    piece:int = 1024 * 1024
+
+    def __init__(self):
+        self.crc32c = google_crc32c.Checksum()
+        self.md5 = hashlib.md5()
+        self.length = 0
+
+    def update(self, data):
+        self.md5.update(data)
+        #The C extension of google_crc32c only takes bytes, so views of the upload map are copied a piece at a time
+        with memoryview(data) as view:
+            for start in range(0, len(view), self.piece):
+                with view[start:start + self.piece] as piece:
+                    self.crc32c.update(bytes(piece))
+        self.length += len(data)
+
+    def digests(self) -> dict[str, str]:
+        #Base64 like the x-goog-hash header and the crc32c/md5Hash fields of a GCS object
+        return {
+            "crc32c":b64encode(self.crc32c.digest()).decode("ascii"),
+            "md5":b64encode(self.md5.digest()).decode("ascii")
+        }
+
+
+def parse_goog_hash(header:str) -> dict[str, str]:
+    #"crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ==" -> {"crc32c":..., "md5":...}
+    digests = {}
+    for part in (header or "").split(","):
+        name, _, value = part.strip().partition("=")
+        if (value):
+            digests[name] = value
+    return digests
+
+
+def object_digests(resource:dict) -> dict[str, str]:
+    #Digests from the JSON resource GCS returns once an upload completes
+    digests = {"crc32c":resource.get("crc32c"), "md5":resource.get("md5Hash")}
+    return {name:value for name, value in digests.items() if (value)}
+
+
+def matches(digests:dict[str, str], expected:dict[str, str]) -> bool:
+    #Compares the digests both sides have, composite objects for example carry no md5
+    return all(digests.get(name) == value for name, value in expected.items() if (name in digests))
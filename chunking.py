@@ -0,0 +1,122 @@
+import json
+import math
+
+
+class AdaptiveChunkSize:
+    """AIMD window for the bytes sent or fetched per chunk.
+
+    The size doubles while the chunk latency stays close to the best latency seen
+    so far, grows by one step once it passed the last size that misbehaved, and is
+    halved when a chunk is slow or fails."""
+
+    def __init__(self, initial:int, minimum:int, maximum:int, alignment:int=1, tolerance:float=1.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.alignment = alignment
+        self.tolerance = tolerance
+        self.threshold = maximum
+        self.baseline:float = None
+        self.size = self.clamp(initial)
+
+    def clamp(self, size:int) -> int:
+        size = max(self.minimum, min(self.maximum, size))
+        return max(self.alignment, size // self.alignment * self.alignment)
+
+    def record(self, elapsed:float) -> int:
+        #Flat latency means the chunk is dominated by round trip overhead, so a bigger one is almost free
+        if (self.baseline is None or elapsed < self.baseline):
+            self.baseline = elapsed
+        else:
+            #Drifts up slowly so the baseline follows a link that got slower
+            self.baseline += (elapsed - self.baseline) * 0.05
+
+        if (elapsed <= self.baseline * self.tolerance):
+            if (self.size < self.threshold):
+                self.size = self.clamp(self.size * 2)
+            else:
+                self.size = self.clamp(self.size + max(self.alignment, self.minimum))
+        elif (elapsed > self.baseline * self.tolerance * 2):
+            self.decrease()
+        return self.size
+
+    def decrease(self) -> int:
+        self.threshold = self.clamp(self.size // 2)
+        self.size = self.threshold
+        return self.size
+
+
+class CompletionBitmap:
+    """One bit per fixed-size block of a download, saved next to the cache file so a
+    partially downloaded file can be resumed instead of fetched again. version identifies
+    the object the blocks came from (generation, ETag or hashes)."""
+
+    def __init__(self, total_size:int, block_size:int, version:str=None):
+        self.total_size = total_size
+        self.block_size = block_size
+        self.version = version
+        self.blocks = math.ceil(total_size / block_size)
+        self.bits = bytearray(math.ceil(self.blocks / 8))
+        self.first_missing = 0
+
+    def __contains__(self, block:int) -> bool:
+        return bool(self.bits[block >> 3] & (1 << (block & 7)))
+
+    def mark(self, start:int, end:int):
+        #Marks the blocks covering bytes start..end (inclusive) as downloaded
+        for block in range(start // self.block_size, end // self.block_size + 1):
+            self.bits[block >> 3] |= 1 << (block & 7)
+        self.advance()
+
+    def advance(self):
+        while (self.first_missing < self.blocks and self.first_missing in self):
+            self.first_missing += 1
+
+    def is_complete(self) -> bool:
+        return self.first_missing >= self.blocks
+
+    def downloaded(self) -> int:
+        blocks = sum(bin(byte).count("1") for byte in self.bits)
+        if (self.blocks and (self.blocks - 1) in self):
+            #The last block is usually shorter than block_size
+            return (blocks - 1) * self.block_size + self.total_size - (self.blocks - 1) * self.block_size
+        return blocks * self.block_size
+
+    def missing_ranges(self, count:int, max_length:int) -> list[tuple[int, int]]:
+        #Up to count byte ranges (inclusive) of missing blocks, each at most max_length long
+        ranges = []
+        blocks_per_range = max(1, max_length // self.block_size)
+        block = self.first_missing
+        while (block < self.blocks and len(ranges) < count):
+            if (block in self):
+                block += 1
+                continue
+            first = block
+            while (block < self.blocks and block not in self and block - first < blocks_per_range):
+                block += 1
+            ranges.append((first * self.block_size, min(block * self.block_size, self.total_size) - 1))
+        return ranges
+
+    def save(self, path:str):
+        with open(path, 'w') as f:
+            f.write(json.dumps({"total_size":self.total_size, "block_size":self.block_size, "version":self.version, "bits":self.bits.hex()}))
+
+    @classmethod
+    def load(cls, path:str, total_size:int, block_size:int, version:str=None):
+        #Returns None when there is no saved progress for this exact object. A new version of the same
+        #size would otherwise mix its blocks with the old ones, so progress of an unknown version is not kept
+        try:
+            with open(path, 'r') as f:
+                saved:dict = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+        if (saved.get("total_size") != total_size or saved.get("block_size") != block_size):
+            return None
+        if (version is None or saved.get("version") != version):
+            return None
+        bitmap = cls(total_size, block_size, version)
+        bits = bytearray.fromhex(saved.get("bits", ""))
+        if (len(bits) != len(bitmap.bits)):
+            return None
+        bitmap.bits = bits
+        bitmap.advance()
+        return bitmap
@@ -0,0 +1,169 @@
+from checksums import StreamingDigest
+import zlib
+import os
+
+try:
+    import zstandard
+    _HAS_ZSTANDARD = True
+except ImportError:
+    zstandard = None
+    _HAS_ZSTANDARD = False
+
+#Optional compression of uploads. The codec is recorded with the file entry and the
+#object holds the compressed stream, downloads decompress it while hashing.
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+SAMPLE_SIZE = 64 * 1024
+MIN_SAVING = 0.1 #a sample that shrinks less than this is sent raw
+READ_SIZE = 1024 * 1024
+
+COMPRESSIBLE_EXTENSIONS = {
+    ".txt", ".md", ".rtf", ".py", ".js", ".ts", ".json", ".csv", ".tsv", ".xml", ".html", ".htm",
+    ".css", ".log", ".ini", ".cfg", ".yaml", ".yml", ".sql", ".c", ".h", ".cpp", ".java", ".sh", ".svg"
+}
+#Formats that are compressed already, checked first so they are never sampled
+COMPRESSED_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".mp3", ".m4a", ".ogg", ".flac", ".mp4", ".mov", ".mkv",
+    ".webm", ".avi", ".zip", ".gz", ".bz2", ".xz", ".7z", ".rar", ".zst", ".pdf", ".docx", ".xlsx", ".pptx"
+}
+
+
+def default_codec() -> str:
+    #zlib ships with Python, so every machine can read the object. zstd is only used when asked
+    #for, a machine without zstandard can not open what it wrote
+    return "zlib"
+
+
+def supported(codec:str) -> bool:
+    return codec == "zlib" or (codec == "zstd" and _HAS_ZSTANDARD)
+
+
+def compressor(codec:str):
+    if (not supported(codec)):
+        raise ValueError(f"Unsupported codec {codec}")
+    if (codec == "zstd"):
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    if (codec == "zlib"):
+        return zlib.compressobj(ZLIB_LEVEL)
+
+
+def decompressor(codec:str):
+    if (not supported(codec)):
+        raise ValueError(f"Unsupported codec {codec}")
+    if (codec == "zstd"):
+        return zstandard.ZstdDecompressor().decompressobj()
+    if (codec == "zlib"):
+        return zlib.decompressobj()
+
+
+def choose_codec(path:str, codec:str=None) -> str:
+    #Codec for uploading path, None for media and anything else that does not shrink
+    extension = os.path.splitext(path)[1].lower()
+    if (extension in COMPRESSED_EXTENSIONS or extension not in COMPRESSIBLE_EXTENSIONS):
+        return None
+    codec = codec or default_codec()
+    with open(path, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+    if (not sample):
+        return None
+    sampler = compressor(codec)
+    compressed = len(sampler.compress(sample)) + len(sampler.flush())
+    return codec if (compressed <= len(sample) * (1 - MIN_SAVING)) else None
+
+
+class CompressedStream:
+    """Compressed bytes of a file produced a read at a time. Only the bytes from base on
+    are kept, the upload discards them once the session committed them. The output is
+    deterministic, so an interrupted upload can regenerate the stream up to its offset."""
+
+    def __init__(self, path:str, codec:str):
+        self.codec = codec
+        self.handle = open(path, 'rb')
+        self.compressor = compressor(codec)
+        self.raw_digest = StreamingDigest() #of the file itself, what the file entry records
+        self.buffer = bytearray()
+        self.base = 0 #offset of buffer[0] in the compressed stream
+        self.consumed = 0 #bytes of the file compressed so far
+        self.finished = False
+
+    @property
+    def total(self) -> int:
+        #Length of the compressed stream, only known once the whole file went through
+        return self.base + len(self.buffer) if (self.finished) else None
+
+    def produce(self, end:int):
+        #Compresses until the stream reaches past end or the file ends
+        while (not self.finished and self.base + len(self.buffer) <= end):
+            data = self.handle.read(READ_SIZE)
+            if (data):
+                self.raw_digest.update(data)
+                self.consumed += len(data)
+                self.buffer += self.compressor.compress(data)
+            else:
+                self.buffer += self.compressor.flush()
+                self.finished = True
+
+    def read(self, offset:int, size:int) -> bytes:
+        if (offset < self.base):
+            raise ValueError(f"Offset {offset} was already discarded")
+        self.produce(offset + size)
+        return bytes(self.buffer[offset - self.base:offset - self.base + size])
+
+    def discard(self, offset:int):
+        if (offset > self.base):
+            del self.buffer[:offset - self.base]
+            self.base = offset
+
+    def close(self):
+        self.handle.close()
+
+
+class DecompressedFile:
+    """Writes the decompressed content of a download to path.tmp as its compressed bytes
+    arrive in order, replace() moves it to path once the stream ended."""
+
+    def __init__(self, path:str, codec:str):
+        self.path = path
+        self.decompressor = decompressor(codec)
+        self.digest = StreamingDigest()
+        self.handle = None
+        self.started = False
+
+    def open(self):
+        #Truncated on the first write only, a download closed in between carries on where it was
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.handle = open(f"{self.path}.tmp", 'ab' if (self.started) else 'wb')
+        self.started = True
+
+    def write(self, data):
+        if (not self.handle):
+            self.open()
+        content = self.decompressor.decompress(data)
+        self.handle.write(content)
+        self.digest.update(content)
+
+    def replace(self) -> bool:
+        #False when the compressed stream was cut short
+        if (not self.handle):
+            self.open()
+        if (hasattr(self.decompressor, "flush")):
+            content = self.decompressor.flush()
+            self.handle.write(content)
+            self.digest.update(content)
+        self.close()
+        if (not getattr(self.decompressor, "eof", True)):
+            os.remove(f"{self.path}.tmp")
+            return False
+        os.replace(f"{self.path}.tmp", self.path)
+        return True
+
+    def discard(self):
+        self.close()
+        if (os.path.exists(f"{self.path}.tmp")):
+            os.remove(f"{self.path}.tmp")
+
+    def close(self):
+        if (self.handle):
+            self.handle.close()
+            self.handle = None
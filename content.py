@@ -0,0 +1,62 @@
+from checksums import StreamingDigest
+import hashlib
+import json
+import os
+
+#Hash-first uploads. A file is stored once per user under files/<localId>/.content/<sha256>
+#and every path holding the same bytes points at that object, so uploading content the
+#user already has only writes the database entry. The object is deleted once no path
+#points at it anymore, the count is kept in the database entry and changed with conditional writes.
+
+READ_SIZE = 1024 * 1024
+
+
+def content_object(user_id:str, sha256:str, version:str=None) -> str:
+    #Every upload of the content gets its own version, so deleting a released object never
+    #touches one that a concurrent upload of the same bytes just stored
+    name = f"files/{user_id}/.content/{sha256}"
+    return f"{name}.{version}" if (version) else name
+
+
+def file_digests(path:str) -> dict[str, str]:
+    #SHA-256 for the content index plus the CRC32C/MD5 stored with the file entry, in one read
+    digest = StreamingDigest()
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        data = f.read(READ_SIZE)
+        while (data):
+            digest.update(data)
+            sha256.update(data)
+            data = f.read(READ_SIZE)
+    return {"sha256":sha256.hexdigest(), **digest.digests()}
+
+
+class ContentIndex:
+    """Local copy of the user's content index (sha256 -> object and codec), the database
+    holds the authoritative one under content_index/<localId> along with the number of
+    file entries pointing at each object."""
+
+    def __init__(self, user_id:str):
+        self.path = f'{os.environ.get("CACHE_PATH")}/.content/{user_id}.json'
+        try:
+            with open(self.path, 'r') as f:
+                self.objects:dict[str, dict] = json.loads(f.read())
+        except (FileNotFoundError, ValueError):
+            self.objects = {}
+
+    def get(self, sha256:str) -> dict:
+        return self.objects.get(sha256)
+
+    def add(self, sha256:str, entry:dict):
+        self.objects[sha256] = entry
+        self.save()
+
+    def remove(self, sha256:str):
+        if (self.objects.pop(sha256, None) is not None):
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.tmp", 'w') as f:
+            f.write(json.dumps(self.objects))
+        os.replace(f"{self.path}.tmp", self.path)
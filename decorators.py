@@ -1,5 +1,7 @@
 from time import sleep
 from logging import getLogger
+from metrics import RETRIES, ABORTS
+import requests
 import scheduling
 
 ENCODINGS = [
@@ -30,15 +32,18 @@ def connection_try_decorator(func):
             try:
                 result = func(self, *args, **kwargs)
                 return result
-            except ConnectionError as e:
+            except (ConnectionError, requests.ConnectionError, requests.Timeout) as e:
                 print(f"An error occured. Retrying the request... ({tries}/{max_tries})")
                 logger.error(str(e))
+                RETRIES.inc(function=func.__qualname__)
                 tries += 1
                 sleep(5)
 
         if isinstance(self, scheduling.Process):
             self.error = True
 
+        ABORTS.inc(function=func.__qualname__)
+
         print("Reached the maximum number of tries. Aborting the process...")
         return None
     return wrapper
\ No newline at end of file
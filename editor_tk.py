@@ -435,7 +435,8 @@ class EditorApp:
         try:
             # get_file expects the full cloud_path, not just filename
             # cloud_path is like "documents/gagaga.txt"
-            cached_path = self.firebase.get_file(self.user, cloud_path)
+            # interactive so the open goes ahead of background uploads and syncs
+            cached_path = self.firebase.get_file(self.user, cloud_path, qos="interactive")
             if not cached_path:
                 raise Exception("File not found in cloud storage")
             
@@ -2,11 +2,18 @@ import pyrebase
 from objects import User
 from datetime import datetime
 from scheduling import Computer, UploadProcess, DownloadProcess
+from checksums import StreamingDigest, matches
+from cdc import ChunkStore, manifest
+from content import ContentIndex, content_object, file_digests
+from compression import choose_codec
 from decorators import connection_try_decorator, encode_illegal_symbols, decode_illegal_symbols
+from sessions import pool, STORAGE_HOST, FIREBASE_STORAGE_HOST, OAUTH_HOST
+from metrics import CACHE_HITS, CACHE_MISSES, LOCK_WAIT
 from typing import Callable
 from threading import Thread
-from time import sleep
+from time import sleep, perf_counter
 import atexit
+from uuid import uuid4
 import json
 import os
 
@@ -44,9 +51,16 @@ class Firebase:
     db = fb.database()
     storage = fb.storage()
     lock_refs = []
+    delta_updates:bool = False #update_file sends only the changed chunks of a file, see cdc.py
+    dedup_uploads:bool = True #content the user already stored is referenced instead of uploaded again, see content.py
+    compress_uploads:bool = True #text like files are stored compressed, see compression.py
 
     def __init__(self, computer:Computer):
         self.computer = computer
+        self.resumed:dict[str, dict] = {} #journal entries of uploads being replayed, by journal key
+        #Database and storage calls go through the pooled keep-alive connections shared with the transfers
+        pool.mount(self.fb.requests, firebaseConfig["databaseURL"])
+        pool.mount(self.fb.requests, FIREBASE_STORAGE_HOST)
 
     def clean_at_exit(self, user:User):
         atexit.register(lambda: self.clean_locked_paths(user))
@@ -57,6 +71,7 @@ class Firebase:
             raise ValueError(f"{operation} is among the list of operations allowed to lock")
 
         lock_ref = encode_illegal_symbols(cloud_path.replace("/", "&456"))
+        start = perf_counter()
         locks:dict[str, dict[str, str]] = self.db.child("locks").child(user.localId).get(token=user.idToken).val()
         if (not locks):
             locks = {}
@@ -66,6 +81,7 @@ class Firebase:
             sleep(1)
         locks[lock_ref] = operation
         self.db.child("locks").child(user.localId).update(locks, token=user.idToken)
+        LOCK_WAIT.record(perf_counter() - start)
         self.lock_refs.append(lock_ref)
         return lock_ref
 
@@ -78,11 +94,204 @@ class Firebase:
             self.unlock_path(user, lock_ref)
 
 
-    def login(self, email:str, password:str) -> User:
+    def login(self, email:str, password:str, prewarm:bool=True, resume:bool=True) -> User:
         result = self.auth.sign_in_with_email_and_password(email, password)
         user = User(email, password)
         user.setup_account(result)
+        if (prewarm):
+            pool.prewarm([firebaseConfig["databaseURL"], FIREBASE_STORAGE_HOST, STORAGE_HOST, OAUTH_HOST])
+        if (resume):
+            self.resume_transfers(user)
         return user
+
+    def resume_transfers(self, user:User):
+        #Restarts the transfers of the user that were still journaled when the app last exited. The entry
+        #is dropped first, the new process records it again, so a replay that fails does not come back every login
+        for entry in self.computer.journal.pending(user.localId):
+            self.computer.journal.discard(entry)
+            if (entry.get("type") == "download"):
+                self.get_thread(user, entry.get("cloud_path"))
+            elif (entry.get("type") == "upload" and os.path.exists(entry.get("file"))):
+                #Kept aside so new_upload_process still finds the session to carry on
+                self.resumed[self.computer.journal.key(entry)] = entry
+                self.upload_thread(user, entry.get("cloud_path"), entry.get("file"))
+
+    def new_upload_process(self, user:User, cloud_path:str, file_path:str, object_name:str=None, codec:str=None) -> UploadProcess:
+        #Reuses the resumable session of an interrupted upload of the same, unchanged file
+        object_name = object_name or f"files/{user.localId}/{cloud_path}"
+        key = self.computer.journal.key({"type":"upload", "user":user.localId, "cloud_path":cloud_path})
+        entry = self.resumed.pop(key, None) or self.computer.journal.find("upload", user.localId, cloud_path)
+        if (entry and entry.get("upload_url") and entry.get("file") == file_path and entry.get("object_name", object_name) == object_name and entry.get("codec") == codec and entry.get("file_size") == os.path.getsize(file_path) and entry.get("modified") == os.path.getmtime(file_path)):
+            return UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path, entry.get("upload_url"), entry.get("offset", 0), object_name, codec)
+        return UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path, object_name=object_name, codec=codec)
+
+    def transfers(self, user:User, cloud_path:str) -> list:
+        #Uploads and downloads of cloud_path that are queued, running or paused
+        cloud_path = cloud_path.strip("/")
+        return [process for process in self.computer.get_processes(user.localId) if (process.operation == cloud_path)]
+
+    def cancel_transfer(self, user:User, cloud_path:str) -> bool:
+        #The waiting upload_file or get_file call returns and releases its lock on the path
+        return any([self.computer.cancel(process.process_id) for process in self.transfers(user, cloud_path)])
+
+    def pause_transfer(self, user:User, cloud_path:str) -> bool:
+        return any([self.computer.pause(process.process_id) for process in self.transfers(user, cloud_path)])
+
+    def resume_transfer(self, user:User, cloud_path:str) -> bool:
+        return any([self.computer.resume(process.process_id) for process in self.transfers(user, cloud_path)])
+
+    def upload_codec(self, file_path:str) -> str:
+        return choose_codec(file_path) if (self.compress_uploads) else None
+
+    def content_upload(self, user:User, cloud_path:str, file_path:str) -> dict:
+        #Hashes the file first and only uploads content the user does not have in storage yet. The returned
+        #fields of the file entry already hold a reference to the object, None when the upload failed
+        digests = file_digests(file_path)
+        sha256 = digests["sha256"]
+        index = ContentIndex(user.localId)
+        #The local index is only a hint, the reference has to land on the database entry
+        entry = self.retain_content(user, sha256)
+        if (entry is None):
+            index.remove(sha256)
+            #An interrupted upload of the same content carries on in its own object
+            key = self.computer.journal.key({"type":"upload", "user":user.localId, "cloud_path":cloud_path})
+            journaled = self.resumed.get(key) or self.computer.journal.find("upload", user.localId, cloud_path) or {}
+            object_name = journaled.get("object_name") or ""
+            if (not object_name.startswith(f"{content_object(user.localId, sha256)}.")):
+                object_name = content_object(user.localId, sha256, uuid4().hex)
+            #The object keeps the codec it was first stored with, whatever name later copies have
+            process = self.new_upload_process(user, cloud_path, file_path, object_name, self.upload_codec(file_path))
+            if (not self.computer.execute(process)):
+                return None
+            #The object is named by the hash taken before the upload, a file changed in between is not indexed
+            if (process.digests != {name:digests[name] for name in process.digests}):
+                print("File changed while uploading")
+                self.storage.delete(object_name, user.idToken)
+                return None
+            entry = self.index_content(user, sha256, {'object':object_name, 'codec':process.codec, 'size':process.file_size})
+        elif (index.get(sha256)):
+            print("Content already in storage, skipping the upload")
+        else:
+            print("Content already stored from another device, skipping the upload")
+        index.add(sha256, {name:entry.get(name) for name in ('object', 'codec', 'size')})
+        return {**digests, 'object':entry.get('object'), 'codec':entry.get('codec'), 'storage':None, 'manifest':None}
+
+    def transact(self, user:User, path:list[str], change:Callable[[dict], dict]) -> tuple[dict, dict]:
+        #Read-modify-write of a database node that only lands if nobody wrote the node in between (ETag
+        #if-match), otherwise change runs again on what is there now. Returns the value before and after it
+        current = self.db.child(*path).get_etag(token=user.idToken)
+        while (True):
+            value = change(current["value"])
+            if (value == current["value"]):
+                return current["value"], value
+            if (value is None):
+                result = self.db.child(*path).conditional_remove(current["ETag"], token=user.idToken)
+            else:
+                result = self.db.child(*path).conditional_set(value, current["ETag"], token=user.idToken)
+            #A precondition failure hands back the node as it is now
+            if (not (isinstance(result, dict) and "ETag" in result)):
+                return current["value"], value
+            current = result
+
+    def retain_content(self, user:User, sha256:str) -> dict:
+        #Adds a reference to a stored content object, None when there is none to reference
+        _, entry = self.transact(user, ['users', user.localId, 'content_index', sha256], lambda entry: entry and {**entry, 'refs':entry.get('refs', 0) + 1})
+        return entry
+
+    def index_content(self, user:User, sha256:str, stored:dict) -> dict:
+        #Indexes a just uploaded object with its first reference. If a concurrent upload of the same
+        #content indexed its own object first, that one is referenced and this one deleted
+        _, entry = self.transact(user, ['users', user.localId, 'content_index', sha256], lambda entry: {**entry, 'refs':entry.get('refs', 0) + 1} if (entry) else {**stored, 'refs':1})
+        if (entry.get('object') != stored['object']):
+            self.storage.delete(stored['object'], user.idToken)
+        return entry
+
+    def release_content(self, user:User, sha256:str):
+        #Deletes the content object and its index entry once the last file entry pointing at it is gone
+        entry, remaining = self.transact(user, ['users', user.localId, 'content_index', sha256], lambda entry: entry and ({**entry, 'refs':entry.get('refs', 0) - 1} if (entry.get('refs', 0) > 1) else None))
+        if (entry is not None and remaining is None):
+            self.storage.delete(entry.get('object'), user.idToken)
+            ContentIndex(user.localId).remove(sha256)
+
+    def retain_chunks(self, user:User, chunks:set[str]) -> dict[str, str]:
+        #Adds a reference to every chunk of a manifest that is stored already and returns their objects,
+        #the chunks missing from the result have to be uploaded
+        retained = {}
+        def change(index:dict) -> dict:
+            retained.clear()
+            index = dict(index or {})
+            for chunk in chunks:
+                if (index.get(chunk)):
+                    index[chunk] = {**index[chunk], 'refs':index[chunk].get('refs', 0) + 1}
+                    retained[chunk] = index[chunk].get('object')
+            return index or None
+        self.transact(user, ['users', user.localId, 'chunk_index'], change)
+        return retained
+
+    def index_chunks(self, user:User, stored:dict[str, str]) -> dict[str, str]:
+        #Indexes just uploaded chunk objects with their first reference, a chunk another upload indexed
+        #in the meantime is referenced instead and the object uploaded here deleted
+        indexed = {}
+        def change(index:dict) -> dict:
+            indexed.clear()
+            index = dict(index or {})
+            for chunk, object_name in stored.items():
+                entry = index.get(chunk)
+                index[chunk] = {**entry, 'refs':entry.get('refs', 0) + 1} if (entry) else {'object':object_name, 'refs':1}
+                indexed[chunk] = index[chunk].get('object')
+            return index
+        if (stored):
+            self.transact(user, ['users', user.localId, 'chunk_index'], change)
+        for chunk, object_name in stored.items():
+            if (indexed[chunk] != object_name):
+                self.storage.delete(object_name, user.idToken)
+        return indexed
+
+    def release_chunks(self, user:User, chunks:set[str]):
+        #Drops one reference from each chunk, the ones no manifest references anymore are deleted here and in storage
+        released = {}
+        def change(index:dict) -> dict:
+            released.clear()
+            index = dict(index or {})
+            for chunk in chunks:
+                entry = index.get(chunk)
+                if (not entry):
+                    continue
+                if (entry.get('refs', 0) > 1):
+                    index[chunk] = {**entry, 'refs':entry.get('refs') - 1}
+                else:
+                    released[chunk] = index.pop(chunk).get('object')
+            return index or None
+        if (chunks):
+            self.transact(user, ['users', user.localId, 'chunk_index'], change)
+        store = ChunkStore(user.localId)
+        for chunk, object_name in released.items():
+            self.storage.delete(object_name, user.idToken)
+            store.remove(chunk)
+
+    def release_manifest(self, user:User, manifest_name:str):
+        #Drops the references the manifest of a delta uploaded file held on its chunks, then the manifest
+        file_manifest = self.fetch_manifest(user, manifest_name)
+        if (file_manifest is None):
+            print("Manifest could not be read, its chunks stay referenced")
+            return
+        self.release_chunks(user, set(file_manifest.get("objects", {})))
+        self.storage.delete(manifest_name, user.idToken)
+
+    def release_entry(self, user:User, entry:dict):
+        #Drops the references a file entry that was deleted or replaced held on its content object or chunks
+        if ((entry or {}).get('object')):
+            self.release_content(user, entry.get('sha256'))
+        elif ((entry or {}).get('manifest')):
+            self.release_manifest(user, entry.get('manifest'))
+
+    def owned_entries(self, entry:dict) -> list[dict]:
+        #A file entry, or every file entry of a folder entry
+        if (not isinstance(entry, dict)):
+            return []
+        if (entry.get('type') == 'file'):
+            return [entry]
+        return [file for key, child in entry.items() if (key != 'type') for file in self.owned_entries(child)]
             
     
     @connection_try_decorator
@@ -100,14 +309,20 @@ class Firebase:
         if (not lock_ref):
             return
 
-        upload_process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path)
-        self.computer.add_process(upload_process)
-        while (not upload_process.is_completed()):
-            print("Uploading...")
-            sleep(0.5)
+        if (self.dedup_uploads):
+            digests = self.content_upload(user, cloud_path, file_path)
+        else:
+            upload_process = self.new_upload_process(user, cloud_path, file_path, codec=self.upload_codec(file_path))
+            digests = {**upload_process.digests, 'codec':upload_process.codec} if (self.computer.execute(upload_process)) else None
+        if (digests is None):
+            self.unlock_path(user, lock_ref)
+            return
 
-        data = {encode_illegal_symbols(file_name):{'type':'file', 'modified':datetime.now().isoformat()}}
+        #An upload to a path that already holds a file replaces its entry
+        previous = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).get(token=user.idToken).val()
+        data = {encode_illegal_symbols(file_name):{'type':'file', 'modified':datetime.now().isoformat(), **digests}}
         self.db.child('users').child(user.localId).child('owned_files').child(*tuple(path)).update(data, token=user.idToken)
+        self.release_entry(user, previous)
         self.unlock_path(user, lock_ref)
 
     @connection_try_decorator
@@ -133,7 +348,10 @@ class Firebase:
 
     @connection_try_decorator
     def delete_folder(self, user:User, folder_name:str, cloud_path):
+        folder = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).child(folder_name).get(token=user.idToken).val()
         self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).child(folder_name).set(None, token=user.idToken)
+        for file in self.owned_entries(folder):
+            self.release_entry(user, file)
 
     @connection_try_decorator
     def get_access_list_ids(self, user:User) -> list[str]:
@@ -141,7 +359,7 @@ class Firebase:
         return files if (files) else []
 
     @connection_try_decorator
-    def update_file(self, user:User, cloud_path:str, file_path:str):
+    def update_file(self, user:User, cloud_path:str, file_path:str, delta:bool=None):
         cloud_path = cloud_path.strip("/")
 
         #locks the cloud path before processing
@@ -149,12 +367,19 @@ class Firebase:
         if (not lock_ref):
             return
         
-        process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, file_path)
-        self.computer.add_process(process)
-        while (not process.is_completed()):
-            print("Uploading...")
-            sleep(0.5)
-        self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).update({'modified':datetime.now().isoformat()}, token=user.idToken)
+        if (self.delta_updates if (delta is None) else delta):
+            data = self.delta_upload(user, cloud_path, file_path)
+        elif (self.dedup_uploads):
+            data = self.content_upload(user, cloud_path, file_path)
+        else:
+            process = self.new_upload_process(user, cloud_path, file_path, codec=self.upload_codec(file_path))
+            data = {**process.digests, 'codec':process.codec, 'storage':None, 'object':None, 'sha256':None, 'manifest':None} if (self.computer.execute(process)) else None
+        if (data is None):
+            self.unlock_path(user, lock_ref)
+            return
+        previous = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).get(token=user.idToken).val()
+        self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).update({'modified':datetime.now().isoformat(), **data}, token=user.idToken)
+        self.release_entry(user, previous)
         
         self.unlock_path(user, lock_ref)
 
@@ -164,12 +389,17 @@ class Firebase:
         if (not self.file_is_owned(user, encode_illegal_symbols(cloud_path).split("/")[-1], self.get_owned_files(user))):
             print("File is not owned by the user. Can't delete it")
             return
-        self.storage.delete(f'files/{user.localId}/{cloud_path}', user.idToken)
+        file = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).get(token=user.idToken).val()
+        #Content objects and chunks may back other paths as well, they go once no entry points at them
+        if (not (file or {}).get('object') and not (file or {}).get('manifest')):
+            self.storage.delete(f'files/{user.localId}/{cloud_path}', user.idToken)
         self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).set(None, token=user.idToken)
+        self.release_entry(user, file)
         print("File is deleted")
 
     @connection_try_decorator
-    def get_file(self, user:User, cloud_path:str) -> str:
+    def get_file(self, user:User, cloud_path:str, qos:str="background") -> str:
+        #qos "interactive" for a file the user is waiting to open, it goes ahead of background transfers
         cloud_path = cloud_path.strip("/")
         file = self.db.child('users').child(user.localId).child('owned_files').child(*tuple(encode_illegal_symbols(cloud_path).split("/"))).get(token=user.idToken).val()
         if (not file):
@@ -181,19 +411,26 @@ class Firebase:
         except FileNotFoundError:
             cache_meta = {}
         
-        if (cache_meta.get("modified") != file.get('modified', '')):
+        if (not self.cache_is_fresh(file, cache_meta, f"{os.environ.get("CACHE_PATH")}/{cloud_path}")):
             print('file is outdated')
-            url = self.storage.child(f'files/{user.localId}/{cloud_path}').get_url(user.idToken)
+            CACHE_MISSES.inc()
             lock_ref = self.lock_path(user, cloud_path, 'read')
             if (not lock_ref):
                 return
-            process = DownloadProcess(url, user, cloud_path)
-            self.computer.add_process(process)
-            while (not process.is_completed() and not process.error):
-                sleep(0.5)
-            self.unlock_path(user, lock_ref)
-            if (process.error):
+            try:
+                if (file.get('storage') == 'cdc'):
+                    digests = self.delta_download(user, cloud_path, qos, file.get('manifest'))
+                else:
+                    url = self.storage.child(file.get('object') or f'files/{user.localId}/{cloud_path}').get_url(user.idToken)
+                    process = DownloadProcess(url, user, cloud_path, file.get('codec'))
+                    self.set_qos(process, qos)
+                    digests = process.digests if (self.computer.execute(process)) else None
+            finally:
+                self.unlock_path(user, lock_ref)
+            if (digests is None):
                 return None
+            #The digests of the bytes actually in the cache, verified against the object while downloading
+            file = {**file, **digests}
             try:
                 with open(f"{os.environ.get("CACHE_PATH")}/meta/{encode_illegal_symbols(cloud_path)}.json", 'w') as f:
                     f.write(json.dumps(file))
@@ -201,13 +438,128 @@ class Firebase:
                 os.makedirs(f"{os.environ.get('CACHE_PATH')}/meta/{'/'.join(cloud_path.split('/')[:-1])}", exist_ok=True)
                 with open(f"{os.environ.get('CACHE_PATH')}/meta/{encode_illegal_symbols(cloud_path)}.json", 'w') as f:
                     f.write(json.dumps(file))
+        else:
+            CACHE_HITS.inc()
         return f"{os.environ.get("CACHE_PATH")}/{cloud_path}"
 
+    def set_qos(self, process:DownloadProcess, qos:str):
+        #Interactive reads also get a short deadline so the edf policy serves them first too
+        process.qos = qos
+        if (qos == "interactive"):
+            process.deadline = process.arrival_time + self.computer.settings.get("interactive_deadline")
+
+    def delta_upload(self, user:User, cloud_path:str, file_path:str) -> dict:
+        #Uploads the chunks storage does not have yet, then a new manifest listing them
+        store = ChunkStore(user.localId)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        digest = StreamingDigest()
+        digest.update(data)
+        file_manifest = manifest(data, digest.digests())
+
+        start = 0
+        for chunk, length in file_manifest["chunks"]:
+            #Every chunk is kept locally so later downloads of this or another file can reuse it
+            store.put(chunk, data[start:start + length])
+            start += length
+        #The manifest references every chunk it lists, the database decides which ones are stored already
+        chunks = {chunk for chunk, _ in file_manifest["chunks"]}
+        objects = self.retain_chunks(user, chunks)
+        processes:dict[str, UploadProcess] = {}
+        for chunk in chunks - objects.keys():
+            process = UploadProcess(firebaseConfig["storageBucket"], user, chunk, store.path(chunk), object_name=f"chunks/{user.localId}/{chunk}.{uuid4().hex}")
+            process.operation = cloud_path
+            process.journaled = False
+            processes[chunk] = process
+        print(f"{len(processes)} of {len(file_manifest['chunks'])} chunks changed")
+        uploaded = self.computer.execute_all(list(processes.values()))
+        objects.update(self.index_chunks(user, {chunk:process.object_name for chunk, process in processes.items() if (process.is_completed())}))
+        if (not uploaded):
+            self.release_chunks(user, set(objects))
+            return None
+
+        #Each version of the file gets its own manifest, the one it replaces is still needed to release its chunks
+        file_manifest["objects"] = objects
+        manifest_name = f"files/{user.localId}/.manifests/{uuid4().hex}.json"
+        manifest_path = f'{os.environ.get("CACHE_PATH")}/.cdc/manifests/{os.path.basename(manifest_name)}'
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            f.write(json.dumps(file_manifest))
+        process = UploadProcess(firebaseConfig["storageBucket"], user, cloud_path, manifest_path, object_name=manifest_name)
+        process.journaled = False
+        uploaded = self.computer.execute(process)
+        os.remove(manifest_path)
+        if (not uploaded):
+            self.release_chunks(user, set(objects))
+            return None
+        return {**digest.digests(), 'storage':'cdc', 'manifest':manifest_name, 'object':None, 'sha256':None, 'codec':None}
+
+    def fetch_manifest(self, user:User, manifest_name:str, qos:str="background", operation:str=None) -> dict:
+        process = DownloadProcess(self.storage.child(manifest_name).get_url(user.idToken), user, f".cdc/manifests/{encode_illegal_symbols(manifest_name)}")
+        process.operation = operation
+        process.journaled = False
+        self.set_qos(process, qos)
+        if (not self.computer.execute(process)):
+            return None
+        with open(process.path, 'r') as f:
+            file_manifest:dict = json.loads(f.read())
+        os.remove(process.path)
+        return file_manifest
+
+    def delta_download(self, user:User, cloud_path:str, qos:str="background", manifest_name:str=None) -> dict:
+        #Fetches the manifest and the chunks missing locally, then rebuilds the file in the cache.
+        #Files delta uploaded before manifests were versioned keep theirs at the path of the file
+        store = ChunkStore(user.localId)
+        file_manifest = self.fetch_manifest(user, manifest_name or f'files/{user.localId}/{cloud_path}', qos, cloud_path)
+        if (file_manifest is None):
+            return None
+
+        objects:dict[str, str] = file_manifest.get("objects", {})
+        missing = {chunk for chunk, _ in file_manifest["chunks"] if (not store.has(chunk))}
+        processes = []
+        for chunk in missing:
+            url = self.storage.child(objects.get(chunk) or f'chunks/{user.localId}/{chunk}').get_url(user.idToken)
+            process = DownloadProcess(url, user, f".cdc/chunks/{user.localId}/{chunk[:2]}/{chunk}")
+            process.operation = cloud_path
+            process.journaled = False
+            self.set_qos(process, qos)
+            processes.append(process)
+        print(f"{len(missing)} of {len(file_manifest['chunks'])} chunks downloaded")
+        if (not self.computer.execute_all(processes)):
+            return None
+
+        path = f'{os.environ.get("CACHE_PATH")}/{cloud_path}'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        digest = StreamingDigest()
+        intact = True
+        with open(f"{path}.tmp", 'wb') as f:
+            for chunk, length in file_manifest["chunks"]:
+                data = store.get(chunk)
+                if (data is None or len(data) != length):
+                    intact = False
+                    break
+                f.write(data)
+                digest.update(data)
+        expected = {name:file_manifest[name] for name in ("crc32c", "md5") if (name in file_manifest)}
+        if (not intact or not matches(digest.digests(), expected)):
+            os.remove(f"{path}.tmp")
+            return None
+        os.replace(f"{path}.tmp", path)
+        return digest.digests()
+
+    def cache_is_fresh(self, file:dict, cache_meta:dict, path:str) -> bool:
+        if (not os.path.exists(path)):
+            return False
+        #Files uploaded with checksums are compared by content, older ones by their modified time
+        if (file.get('crc32c') and cache_meta.get('crc32c')):
+            return file.get('crc32c') == cache_meta.get('crc32c') and file.get('md5', cache_meta.get('md5')) == cache_meta.get('md5')
+        return cache_meta.get("modified") == file.get('modified', '')
+
     def upload_thread(self, user:User, cloud_path:str, file_path:str, on_finish:Callable=None):
         CustomThread(self.upload_file, args=(user, cloud_path, file_path), on_finish=on_finish).start()
     
-    def get_thread(self, user:User, cloud_path:str, on_finish:Callable=None):
-        CustomThread(self.get_file, args=(user, cloud_path), on_finish=on_finish).start()
+    def get_thread(self, user:User, cloud_path:str, on_finish:Callable=None, qos:str="background"):
+        CustomThread(self.get_file, args=(user, cloud_path, qos), on_finish=on_finish).start()
     
     def update_thread(self, user:User, cloud_path:str, file_path:str, on_finish:Callable=None):
         CustomThread(self.update_file, args=(user, cloud_path, file_path), on_finish=on_finish).start()
@@ -0,0 +1,85 @@
+from time import perf_counter
+from threading import Lock
+import json
+import os
+
+
+class TransferJournal:
+    """On-disk list of the transfers in flight, so the ones interrupted by an exit are
+    resumed at the next login. Changes are kept in memory and written at most every
+    interval seconds in one atomic replace of CACHE_PATH/journal.json."""
+
+    interval:float = 2 #seconds between writes while transfers run
+
+    def __init__(self, path:str=None):
+        self.given_path = path
+        self.entries:dict[str, dict] = None
+        self.dirty = False
+        self.flushed = perf_counter()
+        self.lock = Lock()
+
+    @property
+    def path(self) -> str:
+        #Resolved on use, CACHE_PATH is only loaded from .env once the app started
+        return self.given_path or f'{os.environ.get("CACHE_PATH")}/journal.json'
+
+    def key(self, entry:dict) -> str:
+        return f'{entry.get("type")}/{entry.get("user")}/{entry.get("cloud_path")}'
+
+    def load(self) -> dict[str, dict]:
+        if (self.entries is None):
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.loads(f.read())
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def record(self, process):
+        #Adds or refreshes the entry of a process, processes without one are not journaled
+        entry = process.journal_entry()
+        if (not entry):
+            return
+        with self.lock:
+            entries = self.load()
+            key = self.key(entry)
+            if (entries.get(key) != entry):
+                entries[key] = entry
+                self.dirty = True
+
+    def remove(self, process):
+        entry = process.journal_entry()
+        if (entry):
+            self.discard(entry)
+
+    def discard(self, entry:dict):
+        with self.lock:
+            if (self.load().pop(self.key(entry), None) is not None):
+                self.dirty = True
+
+    def find(self, type:str, user:str, cloud_path:str) -> dict:
+        with self.lock:
+            return self.load().get(self.key({"type":type, "user":user, "cloud_path":cloud_path}))
+
+    def pending(self, user:str) -> list[dict]:
+        with self.lock:
+            return [entry for entry in self.load().values() if (entry.get("user") == user)]
+
+    def checkpoint(self):
+        #Writes the pending changes if the last write is older than interval
+        if (self.dirty and perf_counter() - self.flushed >= self.interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if (not self.dirty):
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w') as f:
+                f.write(json.dumps(self.entries))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            self.dirty = False
+            self.flushed = perf_counter()
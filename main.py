@@ -6,6 +6,7 @@ from desktop.login import LoginWindow
 from desktop.taskbar import Taskbar
 from desktop.desktop import Desktop
 from desktop.splash import SplashScreen
+from metrics import MetricsServer
 from threading import Thread
 from dotenv import load_dotenv
 import os
@@ -53,6 +54,9 @@ def main():
 
     computer = Computer()
     firebase = Firebase(computer)
+    #Opt-in Prometheus endpoint on http://127.0.0.1:<METRICS_PORT>/metrics
+    if (os.environ.get("METRICS_PORT")):
+        MetricsServer(computer, int(os.environ.get("METRICS_PORT"))).start()
     app = create_root()
     load_custom_fonts()
 
@@ -0,0 +1,311 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from threading import Lock, Thread
+from array import array
+from ratelimit import limiter
+import math
+
+#(lowest, highest) value tracked by the histograms of each metric
+METRIC_RANGES = {
+    "turnaround":(1e-3, 1e6), #seconds
+    "waiting":(1e-3, 1e6), #seconds
+    "chunk_latency":(1e-4, 1e4), #seconds
+    "throughput":(1.0, 1e11) #bytes per second
+}
+
+
+class Histogram:
+    """Fixed-memory log-linear histogram in the style of HdrHistogram.
+
+    Every power of two between lowest and highest is split in sub_buckets linear
+    buckets, so a percentile is off by at most 1/sub_buckets of its value."""
+
+    def __init__(self, lowest:float, highest:float, sub_buckets:int=32):
+        self.lowest = lowest
+        self.highest = highest
+        self.sub_buckets = sub_buckets
+        self.exponents = math.ceil(math.log2(highest / lowest)) + 1
+        self.counts = array('Q', bytes(8 * (self.exponents * sub_buckets + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def index(self, value:float) -> int:
+        if (value < self.lowest):
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest)
+        sub_bucket = int((mantissa - 0.5) * 2 * self.sub_buckets)
+        return min((exponent - 1) * self.sub_buckets + sub_bucket + 1, len(self.counts) - 1)
+
+    def value_at(self, index:int) -> float:
+        #Middle of the bucket
+        if (index == 0):
+            return self.lowest
+        exponent, sub_bucket = divmod(index - 1, self.sub_buckets)
+        return self.lowest * 2 ** exponent * (1 + (sub_bucket + 0.5) / self.sub_buckets)
+
+    def record(self, value:float):
+        self.counts[self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other:"Histogram"):
+        for index, count in enumerate(other.counts):
+            if (count):
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q:float) -> float:
+        if (not self.count):
+            return None
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if (seen >= rank):
+                return min(max(self.value_at(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if (self.count) else None
+
+
+class RollingHistogram:
+    """All-time histogram plus a ring of per-interval ones for rolling windows."""
+
+    def __init__(self, lowest:float, highest:float, interval:float=60, slots:int=10):
+        self.lowest = lowest
+        self.highest = highest
+        self.interval = interval
+        self.all_time = Histogram(lowest, highest)
+        #Slot histograms are only allocated once something is recorded in their interval
+        self.slots:list[tuple[int, Histogram]] = [None] * slots
+
+    def record(self, value:float, now:float):
+        self.all_time.record(value)
+        period = int(now // self.interval)
+        slot = self.slots[period % len(self.slots)]
+        if (not slot or slot[0] != period):
+            slot = (period, Histogram(self.lowest, self.highest))
+            self.slots[period % len(self.slots)] = slot
+        slot[1].record(value)
+
+    def snapshot(self, now:float, window:float=None) -> Histogram:
+        #Merged copy, the scheduler keeps recording while it is being read
+        result = Histogram(self.lowest, self.highest)
+        if (window is None):
+            result.merge(self.all_time)
+            return result
+        period = int(now // self.interval)
+        oldest = period - math.ceil(window / self.interval) + 1
+        for slot in list(self.slots):
+            if (slot and oldest <= slot[0] <= period):
+                result.merge(slot[1])
+        return result
+
+
+class TransferStats:
+    """Streaming turnaround, waiting, chunk latency and throughput histograms per
+    (metric, process_type, priority). Written by the scheduler loop only and read
+    from any thread without locking."""
+
+    def __init__(self, interval:float=60, slots:int=10):
+        self.interval = interval
+        self.slots = slots
+        self.histograms:dict[tuple[str, str, int], RollingHistogram] = {}
+
+    def record(self, metric:str, process_type:str, priority:int, value:float, now:float=None):
+        now = datetime.now().timestamp() if (now is None) else now
+        key = (metric, process_type, priority)
+        histogram = self.histograms.get(key)
+        if (not histogram):
+            histogram = RollingHistogram(*METRIC_RANGES[metric], self.interval, self.slots)
+            self.histograms[key] = histogram
+        histogram.record(value, now)
+
+    def snapshot(self, metric:str, process_type:str=None, priority:int=None, window:float=None, now:float=None) -> Histogram:
+        #Merges every histogram of the metric matching the given process type and priority
+        now = datetime.now().timestamp() if (now is None) else now
+        result = Histogram(*METRIC_RANGES[metric])
+        for (name, key_type, key_priority), histogram in list(self.histograms.items()):
+            if (name == metric and process_type in (None, key_type) and priority in (None, key_priority)):
+                result.merge(histogram.snapshot(now, window))
+        return result
+
+    def percentile(self, metric:str, q:float, process_type:str=None, priority:int=None, window:float=None, now:float=None) -> float:
+        return self.snapshot(metric, process_type, priority, window, now).percentile(q)
+
+    def summary(self, metric:str, process_type:str=None, priority:int=None, window:float=None, now:float=None) -> dict:
+        histogram = self.snapshot(metric, process_type, priority, window, now)
+        return {
+            "count":histogram.count,
+            "mean":histogram.mean(),
+            "p50":histogram.percentile(0.5),
+            "p95":histogram.percentile(0.95),
+            "p99":histogram.percentile(0.99),
+            "max":histogram.max if (histogram.count) else None
+        }
+
+
+class Counter:
+    """Monotonic counter with labels. Writers serialize on a lock, readers only copy."""
+
+    def __init__(self, name:str, help:str):
+        self.name = name
+        self.help = help
+        self.values:dict[tuple, float] = {}
+        self.lock = Lock()
+
+    def inc(self, amount:float=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self) -> list[tuple[dict, float]]:
+        return [(dict(key), value) for key, value in list(self.values.items())]
+
+
+class Summary:
+    """Histogram of observations recorded from any thread, exposed as quantiles."""
+
+    def __init__(self, name:str, help:str, lowest:float, highest:float):
+        self.name = name
+        self.help = help
+        self.histogram = Histogram(lowest, highest)
+        self.lock = Lock()
+
+    def record(self, value:float):
+        with self.lock:
+            self.histogram.record(value)
+
+    def snapshot(self) -> Histogram:
+        result = Histogram(self.histogram.lowest, self.histogram.highest)
+        result.merge(self.histogram)
+        return result
+
+
+RETRIES = Counter("cloudos_connection_retries_total", "Retries made by connection_try_decorator")
+ABORTS = Counter("cloudos_connection_aborts_total", "Calls abandoned by connection_try_decorator after the last retry")
+BYTES_TRANSFERRED = Counter("cloudos_bytes_transferred_total", "Bytes moved by the transfer processes")
+CACHE_HITS = Counter("cloudos_cache_hits_total", "get_file calls served from the local cache")
+CACHE_MISSES = Counter("cloudos_cache_misses_total", "get_file calls that had to download the file")
+THROTTLED = Counter("cloudos_throttled_seconds_total", "Time transfers waited between chunks for the bandwidth limiter")
+CHECKSUM_MISMATCHES = Counter("cloudos_checksum_mismatches_total", "Transfers whose CRC32C/MD5 did not match the stored object")
+ADMISSION_WAIT = Counter("cloudos_admission_wait_seconds_total", "Time producers waited in Computer.add_process for a slot under max_in_flight")
+LOCK_WAIT = Summary("cloudos_lock_wait_seconds", "Time spent waiting in Firebase.lock_path", 1e-3, 1e5)
+QUANTILES = [0.5, 0.9, 0.95, 0.99]
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels:dict) -> str:
+    if (not labels):
+        return ""
+    return "{" + ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def render_histogram(lines:list[str], name:str, histogram:Histogram, labels:dict):
+    for q in QUANTILES:
+        if (histogram.count):
+            lines.append(f"{name}{format_labels({**labels, 'quantile':q})} {histogram.percentile(q)}")
+    lines.append(f"{name}_sum{format_labels(labels)} {histogram.total}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+
+def render(computer) -> str:
+    """Prometheus text exposition of the Computer and the process-wide counters.
+    Nothing here takes the scheduler lock, every value is read from a copy."""
+    lines = []
+
+    lines.append("# HELP cloudos_queue_depth Processes waiting in each queue of the scheduling policy")
+    lines.append("# TYPE cloudos_queue_depth gauge")
+    policy = computer.policy
+    for queue, depth in policy.depths().items():
+        lines.append(f"cloudos_queue_depth{format_labels({'policy':policy.name, 'queue':queue})} {depth}")
+
+    lines.append("# HELP cloudos_in_flight Processes admitted by the Computer, queued, running or paused")
+    lines.append("# TYPE cloudos_in_flight gauge")
+    lines.append(f"cloudos_in_flight {len(computer.processes)}")
+    if (computer.settings.get("max_in_flight") is not None):
+        lines.append("# HELP cloudos_max_in_flight Processes the Computer admits before add_process blocks")
+        lines.append("# TYPE cloudos_max_in_flight gauge")
+        lines.append(f"cloudos_max_in_flight {computer.settings.get('max_in_flight')}")
+
+    lines.append("# HELP cloudos_current_process Process running on each worker")
+    lines.append("# TYPE cloudos_current_process gauge")
+    for worker in list(computer.workers):
+        process = worker.current_process
+        if (process):
+            labels = {'worker':worker.worker_id, 'process_id':process.process_id, 'process_type':process.process_type, 'priority':process.priority}
+            lines.append(f"cloudos_current_process{format_labels(labels)} 1")
+
+    for metric in ["chunk_latency", "turnaround", "waiting"]:
+        name = f"cloudos_{metric}_seconds"
+        lines.append(f"# HELP {name} {metric.replace('_', ' ').capitalize()} of the transfer processes")
+        lines.append(f"# TYPE {name} summary")
+        for process_type in sorted({key[1] for key in list(computer.stats.histograms.keys()) if key[0] == metric}):
+            render_histogram(lines, name, computer.stats.snapshot(metric, process_type), {'process_type':process_type})
+
+    lines.append("# HELP cloudos_rate_limit_bytes Configured bandwidth limit in bytes per second")
+    lines.append("# TYPE cloudos_rate_limit_bytes gauge")
+    for direction in limiter.directions:
+        if (limiter.rate(direction)):
+            lines.append(f"cloudos_rate_limit_bytes{format_labels({'direction':direction})} {limiter.rate(direction)}")
+
+    for counter in [BYTES_TRANSFERRED, THROTTLED, ADMISSION_WAIT, RETRIES, ABORTS, CACHE_HITS, CACHE_MISSES, CHECKSUM_MISMATCHES]:
+        lines.append(f"# HELP {counter.name} {counter.help}")
+        lines.append(f"# TYPE {counter.name} counter")
+        for labels, value in counter.collect():
+            lines.append(f"{counter.name}{format_labels(labels)} {value}")
+
+    lines.append(f"# HELP {LOCK_WAIT.name} {LOCK_WAIT.help}")
+    lines.append(f"# TYPE {LOCK_WAIT.name} summary")
+    render_histogram(lines, LOCK_WAIT.name, LOCK_WAIT.snapshot(), {})
+
+    hits = sum(value for _, value in CACHE_HITS.collect())
+    misses = sum(value for _, value in CACHE_MISSES.collect())
+    lines.append("# HELP cloudos_cache_hit_ratio Share of get_file calls served from the local cache")
+    lines.append("# TYPE cloudos_cache_hit_ratio gauge")
+    lines.append(f"cloudos_cache_hit_ratio {hits / (hits + misses) if (hits + misses) else 0}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Opt-in local endpoint serving render(computer) on http://127.0.0.1:<port>/metrics."""
+
+    def __init__(self, computer, port:int, host:str="127.0.0.1"):
+        self.computer = computer
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if (self.path.split("?")[0] != "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render(server.computer).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    def start(self):
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,460 @@
+from queues import ProcessQueue, FIFOQueue, SRTFQueue, HeapQueue
+from ratelimit import TokenBucket
+
+QOS_CLASSES = ("interactive", "background")
+
+
+class SchedulingPolicy:
+    """Decides which queued process a worker runs next and when a running one gives
+    its worker back. The Computer calls every method with its lock held."""
+
+    name:str = "policy"
+
+    def __init__(self, computer):
+        self.computer = computer
+
+    @property
+    def settings(self) -> dict:
+        return self.computer.settings
+
+    @property
+    def logger(self):
+        return self.computer.logger
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues().values())
+
+    def depths(self) -> dict[str, int]:
+        return {name:len(queue) for name, queue in list(self.queues().items())}
+
+    def add(self, process):
+        process.enqueued_time = self.computer.clock()
+        self.push(process)
+
+    def push(self, process):
+        raise NotImplementedError
+
+    def select(self, worker):
+        raise NotImplementedError
+
+    def charge(self, process):
+        #Accounts the chunk a running process just completed
+        pass
+
+    def should_preempt(self, process) -> bool:
+        #Called after every chunk of a running process that is not done yet
+        return False
+
+    def requeue(self, process):
+        #Puts back a process that was preempted
+        self.add(process)
+
+    def remove(self, process) -> bool:
+        return any([queue.remove(process) for queue in self.queues().values()])
+
+    def update(self, process):
+        for queue in self.queues().values():
+            queue.update(process)
+
+    def finished(self, process):
+        #Forgets a process that completed or failed
+        pass
+
+    def retry_after(self) -> float:
+        #Seconds until a queued process that select() held back may run, None when nothing is held back
+        return None
+
+    def drain(self) -> list:
+        #Empties the policy, used when the Computer switches to another one
+        processes = []
+        for queue in self.queues().values():
+            process = queue.pop()
+            while (process):
+                processes.append(process)
+                process = queue.pop()
+        return processes
+
+
+class FIFOPolicy(SchedulingPolicy):
+    """Baseline: one queue in arrival order, a process keeps its worker until it is done."""
+
+    name:str = "fifo"
+
+    def __init__(self, computer):
+        super().__init__(computer)
+        self.queue = FIFOQueue()
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        return {"fifo":self.queue}
+
+    def push(self, process):
+        self.queue.push(process)
+
+    def select(self, worker):
+        return self.queue.pop()
+
+
+class MLFQPolicy(SchedulingPolicy):
+    """FCFS, RR and SRTF levels with aging towards FCFS and demotion of long running processes.
+    Interactive processes have levels of their own that are served first and preempt background
+    ones, except that background work gets settings["background_share"] of the bytes while both
+    classes have work, so it never starves behind a stream of opens."""
+
+    name:str = "mlfq"
+
+    def __init__(self, computer):
+        super().__init__(computer)
+        self.multi_level_scheduling:dict[str, dict[int, dict[str, ProcessQueue]]] = {qos:{
+            1:{"queue":FIFOQueue()}, #FCFS
+            2:{"queue":FIFOQueue()}, #RR
+            3:{"queue":SRTFQueue()}  #SRTF
+        } for qos in QOS_CLASSES}
+        self.served:dict[str, float] = {qos:0 for qos in QOS_CLASSES} #bytes since both classes had work
+        self.seen:dict[int, int] = {} #process_id -> bytes transferred at its last charge
+        self.running:dict[str, set[int]] = {qos:set() for qos in QOS_CLASSES}
+
+    def qos(self, process) -> str:
+        return process.qos if (process.qos in QOS_CLASSES) else "background"
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        return {f"{qos}/{priority}":level["queue"] for qos, levels in self.multi_level_scheduling.items() for priority, level in levels.items()}
+
+    def queued(self, qos:str) -> bool:
+        return any(len(level["queue"]) > 0 for level in self.multi_level_scheduling[qos].values())
+
+    def busy(self, qos:str) -> bool:
+        return self.queued(qos) or len(self.running[qos]) > 0
+
+    def add(self, process):
+        qos = self.qos(process)
+        if (not self.busy(qos)):
+            #A class that was idle starts the shares over instead of being owed the time it was away
+            self.served = {name:0 for name in QOS_CLASSES}
+        super().add(process)
+
+    def push(self, process):
+        self.multi_level_scheduling[self.qos(process)][process.priority]["queue"].push(process)
+
+    def update(self, process):
+        self.multi_level_scheduling[self.qos(process)][process.priority]["queue"].update(process)
+
+    def remove(self, process) -> bool:
+        self.seen.pop(process.process_id, None)
+        return super().remove(process)
+
+    def age(self):
+        #Only the oldest process of each level can be due, so aging stops at the first one that is not
+        now = self.computer.clock()
+        for qos, levels in self.multi_level_scheduling.items():
+            for priority in range(2, 4):
+                queue = levels[priority]["queue"]
+                process = queue.oldest()
+                while (process and process.waited(now) >= self.settings.get("aging_time")):
+                    queue.remove(process)
+                    process.increase_priority()
+                    super().add(process)
+                    self.logger.info(f"Process {process.process_id} type {process.process_type} aged to priority {process.priority}.")
+                    process = queue.oldest()
+
+    def background_owed(self) -> bool:
+        #Background work is waiting and got less than its share of what both classes moved
+        total = sum(self.served.values())
+        return self.queued("background") and self.served["background"] < self.settings.get("background_share") * total
+
+    def select(self, worker):
+        self.age()
+        order = ("background", "interactive") if (self.background_owed()) else ("interactive", "background")
+        for qos in order:
+            levels = self.multi_level_scheduling[qos]
+            for priority in range(1, 4):
+                queue = levels[priority]["queue"]
+                if (len(queue) > 0):
+                    process = queue.pop()
+                    self.running[qos].add(process.process_id)
+                    self.seen[process.process_id] = process.transferred
+                    self.logger.info(f"Process {process.process_id} type {process.process_type} selected from {qos} priority {priority} queue by worker {worker.worker_id}.")
+                    return process
+        return None
+
+    def charge(self, process):
+        transferred = process.transferred - self.seen.get(process.process_id, process.transferred)
+        self.seen[process.process_id] = process.transferred
+        if (transferred > 0):
+            self.served[self.qos(process)] += transferred
+
+    def should_preempt(self, process) -> bool:
+        self.age()
+        qos = self.qos(process)
+        if (qos == "background" and self.queued("interactive") and not self.background_owed()):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} preempted for an interactive process.")
+            return True
+        if (qos == "interactive" and self.background_owed()):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} preempted for the background share.")
+            return True
+        levels = self.multi_level_scheduling[qos]
+        if (process.priority == 3):
+            if (levels[2]["queue"] or levels[1]["queue"]):
+                self.logger.info(f"Process {process.process_id} type {process.process_type} preempted.")
+                return True
+            shortest = levels[3]["queue"].peek()
+            if (shortest and shortest.burst_time < process.burst_time):
+                self.logger.info(f"Process {process.process_id} type {process.process_type} preempted.")
+                return True
+        elif (process.priority == 2):
+            if (process.sub_processed_time % self.settings.get("time_quantum") == 0):
+                self.logger.info(f"Process {process.process_id} type {process.process_type} time quantum expired.")
+                return True
+        return False
+
+    def requeue(self, process):
+        if (process.sub_processed_time >= self.settings.get("lower_priority_time")):
+            process.decrease_priority()
+            self.logger.info(f"Process {process.process_id} type {process.process_type} lower to priority {process.priority}")
+        #Queued before it stops counting as running, so its class does not look idle in between
+        super().add(process)
+        self.running[self.qos(process)].discard(process.process_id)
+
+    def finished(self, process):
+        self.running[self.qos(process)].discard(process.process_id)
+        self.seen.pop(process.process_id, None)
+
+
+class WeightedFairPolicy(SchedulingPolicy):
+    """Weighted fair queuing at chunk granularity. Every process is a flow whose finish
+    tag grows by 1 / weight per chunk, the smallest tag runs next. Weights come from
+    settings["wfq_weights"] by process type."""
+
+    name:str = "wfq"
+
+    def __init__(self, computer):
+        super().__init__(computer)
+        self.queue = HeapQueue(lambda process: self.finish_tags.get(process.process_id, 0))
+        self.finish_tags:dict[int, float] = {}
+        self.virtual_time = 0.0
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        return {"wfq":self.queue}
+
+    def weight(self, process) -> float:
+        return self.settings.get("wfq_weights", {}).get(process.process_type, 1)
+
+    def push(self, process):
+        #A flow that was idle starts at the current virtual time instead of its old tag
+        tag = max(self.virtual_time, self.finish_tags.get(process.process_id, 0))
+        self.finish_tags[process.process_id] = tag + 1 / self.weight(process)
+        self.queue.push(process)
+
+    def select(self, worker):
+        process = self.queue.pop()
+        if (process):
+            self.virtual_time = self.finish_tags[process.process_id] - 1 / self.weight(process)
+        return process
+
+    def charge(self, process):
+        self.finish_tags[process.process_id] = self.finish_tags.get(process.process_id, self.virtual_time) + 1 / self.weight(process)
+
+    def should_preempt(self, process) -> bool:
+        waiting = self.queue.peek()
+        return bool(waiting and self.finish_tags[waiting.process_id] < self.finish_tags[process.process_id])
+
+    def requeue(self, process):
+        #The finish tag was already advanced for the chunk that just ran
+        process.enqueued_time = self.computer.clock()
+        self.queue.push(process)
+
+    def remove(self, process) -> bool:
+        self.finish_tags.pop(process.process_id, None)
+        return self.queue.remove(process)
+
+    def finished(self, process):
+        self.finish_tags.pop(process.process_id, None)
+
+
+class EDFPolicy(SchedulingPolicy):
+    """Earliest deadline first, meant for interactive opens. A process without a deadline
+    gets arrival_time + settings["default_deadline"]."""
+
+    name:str = "edf"
+
+    def __init__(self, computer):
+        super().__init__(computer)
+        self.queue = HeapQueue(self.deadline)
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        return {"edf":self.queue}
+
+    def deadline(self, process) -> float:
+        if (process.deadline is not None):
+            return process.deadline
+        return process.arrival_time + self.settings.get("default_deadline")
+
+    def push(self, process):
+        self.queue.push(process)
+
+    def select(self, worker):
+        return self.queue.pop()
+
+    def should_preempt(self, process) -> bool:
+        waiting = self.queue.peek()
+        return bool(waiting and self.deadline(waiting) < self.deadline(process))
+
+
+class FairSharePolicy(SchedulingPolicy):
+    """Shares the workers between users. Every user gets their own instance of the
+    wrapped policy, and the next chunk goes to the user with the fewest bytes served
+    relative to their weight in settings["user_weights"]. A user can be capped to
+    settings["user_max_transfers"] running processes and settings["user_max_rate"]
+    bytes per second."""
+
+    def __init__(self, computer, policy:type[SchedulingPolicy]):
+        super().__init__(computer)
+        self.policy = policy
+        self.name = f"{policy.name}/fair_share"
+        self.users:dict[str, SchedulingPolicy] = {}
+        self.served:dict[str, float] = {} #bytes served per user divided by their weight
+        self.running:dict[str, set[int]] = {}
+        self.buckets:dict[str, TokenBucket] = {}
+        self.seen:dict[int, int] = {} #transferred bytes of each running process at its last chunk
+
+    def user(self, process) -> str:
+        return getattr(process.user, "localId", None) or getattr(process.user, "email", None) or ""
+
+    def weight(self, user:str) -> float:
+        return self.settings.get("user_weights", {}).get(user, 1)
+
+    def bucket(self, user:str) -> TokenBucket:
+        rate = self.settings.get("user_max_rate")
+        if (not rate):
+            return None
+        bucket = self.buckets.get(user)
+        if (not bucket):
+            bucket = TokenBucket(rate, clock=self.computer.clock)
+            self.buckets[user] = bucket
+        elif (bucket.rate != rate):
+            bucket.set_rate(rate)
+        return bucket
+
+    def policy_of(self, user:str) -> SchedulingPolicy:
+        policy = self.users.get(user)
+        if (policy is None):
+            policy = self.policy(self.computer)
+            self.users[user] = policy
+            self.served.setdefault(user, 0)
+        return policy
+
+    def active(self, user:str) -> bool:
+        return bool(self.running.get(user)) or (user in self.users and len(self.users[user]) > 0)
+
+    def throttled(self, user:str) -> bool:
+        bucket = self.bucket(user)
+        return bool(bucket and bucket.delay() > 0)
+
+    def eligible(self, user:str) -> bool:
+        limit = self.settings.get("user_max_transfers")
+        if (limit and len(self.running.get(user, ())) >= limit):
+            return False
+        return not self.throttled(user)
+
+    def next_user(self) -> str:
+        best = None
+        for user, policy in self.users.items():
+            if (len(policy) > 0 and self.eligible(user)):
+                if (best is None or self.served[user] < self.served[best]):
+                    best = user
+        return best
+
+    def queues(self) -> dict[str, ProcessQueue]:
+        #Same named queues of every user are reported together
+        return {f"{user}/{name}":queue for user, policy in list(self.users.items()) for name, queue in policy.queues().items()}
+
+    def depths(self) -> dict[str, int]:
+        depths = {}
+        for policy in list(self.users.values()):
+            for name, depth in policy.depths().items():
+                depths[name] = depths.get(name, 0) + depth
+        return depths
+
+    def add(self, process):
+        user = self.user(process)
+        if (not self.active(user)):
+            #A user that was idle starts level with the busiest ones instead of being owed all the time it was away
+            others = [self.served[other] for other in self.users if (other != user and self.active(other))]
+            self.served[user] = max(self.served.get(user, 0), min(others, default=0))
+        self.policy_of(user).add(process)
+
+    def push(self, process):
+        self.policy_of(self.user(process)).push(process)
+
+    def select(self, worker):
+        user = self.next_user()
+        if (user is None):
+            return None
+        process = self.users[user].select(worker)
+        if (process):
+            self.running.setdefault(user, set()).add(process.process_id)
+            self.seen[process.process_id] = process.transferred
+        return process
+
+    def charge(self, process):
+        user = self.user(process)
+        transferred = process.transferred - self.seen.get(process.process_id, process.transferred)
+        self.seen[process.process_id] = process.transferred
+        if (transferred > 0):
+            self.served[user] = self.served.get(user, 0) + transferred / self.weight(user)
+            bucket = self.bucket(user)
+            if (bucket):
+                bucket.consume(transferred)
+        self.policy_of(user).charge(process)
+
+    def should_preempt(self, process) -> bool:
+        user = self.user(process)
+        if (self.throttled(user)):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} paused, user over the rate limit.")
+            return True
+        other = self.next_user()
+        if (other is not None and other != user and self.served[other] < self.served[user]):
+            self.logger.info(f"Process {process.process_id} type {process.process_type} preempted for a user with a smaller share.")
+            return True
+        return self.policy_of(user).should_preempt(process)
+
+    def release(self, process):
+        self.running.get(self.user(process), set()).discard(process.process_id)
+        self.seen.pop(process.process_id, None)
+
+    def requeue(self, process):
+        self.release(process)
+        self.policy_of(self.user(process)).requeue(process)
+
+    def remove(self, process) -> bool:
+        policy = self.users.get(self.user(process))
+        return policy is not None and policy.remove(process)
+
+    def update(self, process):
+        policy = self.users.get(self.user(process))
+        if (policy is not None):
+            policy.update(process)
+
+    def finished(self, process):
+        self.release(process)
+        policy = self.users.get(self.user(process))
+        if (policy is not None):
+            policy.finished(process)
+
+    def drain(self) -> list:
+        processes = []
+        for policy in self.users.values():
+            processes += policy.drain()
+        return processes
+
+    def retry_after(self) -> float:
+        delays = [self.buckets[user].delay() for user, policy in self.users.items() if (len(policy) > 0 and user in self.buckets)]
+        delays = [delay for delay in delays if (delay > 0)]
+        return min(delays, default=None)
+
+
+POLICIES:dict[str, type[SchedulingPolicy]] = {
+    policy.name:policy for policy in [MLFQPolicy, FIFOPolicy, WeightedFairPolicy, EDFPolicy]
+}
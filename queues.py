@@ -0,0 +1,153 @@
+from collections import deque
+from itertools import count
+from typing import Callable
+import heapq
+
+#Marks an entry whose process was removed or re-keyed; it is skipped when it reaches the front
+REMOVED = None
+
+
+class ProcessQueue:
+    """Base for the MLFQ level queues. Entries are kept by process id so a
+    queued process can be removed or re-keyed without scanning the queue."""
+
+    def __init__(self):
+        self.entries:dict[int, list] = {}
+        self.counter = count()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __bool__(self) -> bool:
+        return len(self.entries) > 0
+
+    def __contains__(self, process) -> bool:
+        return process.process_id in self.entries
+
+    def __iter__(self):
+        return iter([entry[-1] for entry in list(self.entries.values())])
+
+    def push(self, process):
+        raise NotImplementedError
+
+    def pop(self):
+        raise NotImplementedError
+
+    def peek(self):
+        raise NotImplementedError
+
+    def remove(self, process) -> bool:
+        entry = self.entries.pop(process.process_id, None)
+        if (entry is None):
+            return False
+        entry[-1] = REMOVED
+        return True
+
+    def update(self, process):
+        pass
+
+    def oldest(self):
+        #Process that has been queued the longest, used for aging
+        raise NotImplementedError
+
+
+class FIFOQueue(ProcessQueue):
+    """FCFS/RR level: O(1) push and pop from a deque."""
+
+    def __init__(self):
+        super().__init__()
+        self.queue:deque[list] = deque()
+
+    def push(self, process):
+        self.remove(process)
+        entry = [next(self.counter), process]
+        self.entries[process.process_id] = entry
+        self.queue.append(entry)
+
+    def _discard_removed(self):
+        while (self.queue and self.queue[0][-1] is REMOVED):
+            self.queue.popleft()
+
+    def pop(self):
+        self._discard_removed()
+        if (not self.queue):
+            return None
+        process = self.queue.popleft()[-1]
+        del self.entries[process.process_id]
+        return process
+
+    def peek(self):
+        self._discard_removed()
+        return self.queue[0][-1] if (self.queue) else None
+
+    def oldest(self):
+        #Entries are appended in enqueue order so the head is also the oldest
+        return self.peek()
+
+
+class HeapQueue(ProcessQueue):
+    """Min-heap keyed by key(process), O(log n) push, pop and re-key."""
+
+    def __init__(self, key:Callable):
+        super().__init__()
+        self.key = key
+        self.heap:list[list] = []
+        #[process] per queued process in enqueue order so aging never has to scan the heap. Kept apart
+        #from the heap entries so re-keying a process does not move it behind younger ones
+        self.by_age:deque[list] = deque()
+        self.ages:dict[int, list] = {}
+
+    def push(self, process):
+        self.remove(process)
+        entry = [self.key(process), next(self.counter), process]
+        self.entries[process.process_id] = entry
+        heapq.heappush(self.heap, entry)
+        age = [process]
+        self.ages[process.process_id] = age
+        self.by_age.append(age)
+
+    def remove(self, process) -> bool:
+        age = self.ages.pop(process.process_id, None)
+        if (age is not None):
+            age[-1] = REMOVED
+        return super().remove(process)
+
+    def _discard_removed(self):
+        while (self.heap and self.heap[0][-1] is REMOVED):
+            heapq.heappop(self.heap)
+
+    def pop(self):
+        self._discard_removed()
+        if (not self.heap):
+            return None
+        entry = heapq.heappop(self.heap)
+        process = entry[-1]
+        del self.entries[process.process_id]
+        entry[-1] = REMOVED
+        self.ages.pop(process.process_id)[-1] = REMOVED
+        return process
+
+    def peek(self):
+        self._discard_removed()
+        return self.heap[0][-1] if (self.heap) else None
+
+    def oldest(self):
+        while (self.by_age and self.by_age[0][-1] is REMOVED):
+            self.by_age.popleft()
+        return self.by_age[0][-1] if (self.by_age) else None
+
+    def update(self, process):
+        #Re-keys a queued process after its key changed, its place in the age order stays
+        entry = self.entries.get(process.process_id)
+        if (entry is not None and entry[0] != self.key(process)):
+            entry[-1] = REMOVED
+            entry = [self.key(process), next(self.counter), process]
+            self.entries[process.process_id] = entry
+            heapq.heappush(self.heap, entry)
+
+
+class SRTFQueue(HeapQueue):
+    """SRTF level: heap keyed by the remaining burst."""
+
+    def __init__(self):
+        super().__init__(lambda process: process.burst_time)
@@ -0,0 +1,100 @@
+from datetime import datetime
+from typing import Callable
+from threading import Lock
+
+
+class TokenBucket:
+    """Bytes per second limit with a burst allowance. Tokens refill continuously up to
+    burst, a transfer takes what it used afterwards and may leave the bucket in debt,
+    which is paid back before the next one is allowed."""
+
+    def __init__(self, rate:float, burst:float=None, clock:Callable[[], float]=None):
+        self.clock = clock or (lambda: datetime.now().timestamp())
+        self.rate = rate
+        self.burst = burst if (burst is not None) else rate
+        self.tokens = self.burst
+        self.updated = self.clock()
+        self.lock = Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount:float):
+        with self.lock:
+            self.refill()
+            self.tokens -= amount
+
+    def available(self) -> float:
+        with self.lock:
+            self.refill()
+            return self.tokens
+
+    def delay(self, amount:float=0) -> float:
+        #Seconds until amount tokens are available, 0 when they already are
+        with self.lock:
+            self.refill()
+            missing = min(amount, self.burst) - self.tokens
+            #Less than a byte short counts as available, the refill is not exact in floating point
+            if (missing < 1):
+                return 0.0
+            return missing / self.rate if (self.rate > 0) else float("inf")
+
+    def set_rate(self, rate:float, burst:float=None):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+            self.burst = burst if (burst is not None) else rate
+            self.tokens = min(self.tokens, self.burst)
+
+
+class BandwidthLimiter:
+    """Process-wide upload and download limits shared by every transfer. A direction
+    without a bucket is unlimited. Transfers ask for a grant before each chunk and
+    get a smaller chunk while the bucket is low, the Computer holds them between
+    chunks while it is in debt."""
+
+    directions = ("upload", "download")
+
+    def __init__(self):
+        self.buckets:dict[str, TokenBucket] = {}
+        self.lock = Lock()
+
+    def set_rate(self, direction:str, rate:float, burst:float=None):
+        #rate in bytes per second, None removes the limit. Safe to call while transfers run
+        if (direction not in self.directions):
+            raise ValueError(f"Unknown direction {direction}")
+        with self.lock:
+            bucket = self.buckets.get(direction)
+            if (not rate):
+                self.buckets.pop(direction, None)
+            elif (bucket):
+                bucket.set_rate(rate, burst)
+            else:
+                self.buckets[direction] = TokenBucket(rate, burst)
+
+    def rate(self, direction:str) -> float:
+        bucket = self.buckets.get(direction)
+        return bucket.rate if (bucket) else None
+
+    def grant(self, direction:str, size:int, minimum:int, alignment:int=1) -> int:
+        #Bytes the next chunk may move, never below minimum so a transfer always makes progress
+        bucket = self.buckets.get(direction)
+        if (not bucket):
+            return size
+        granted = min(size, max(minimum, int(bucket.available())))
+        return max(alignment, granted // alignment * alignment)
+
+    def consume(self, direction:str, amount:int):
+        bucket = self.buckets.get(direction)
+        if (bucket):
+            bucket.consume(amount)
+
+    def delay(self, direction:str) -> float:
+        #Seconds until the direction is out of debt
+        bucket = self.buckets.get(direction)
+        return bucket.delay() if (bucket) else 0.0
+
+
+limiter = BandwidthLimiter()
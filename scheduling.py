@@ -2,24 +2,59 @@ from objects import User
 import google.auth.transport.requests
 from google.oauth2 import service_account
 from decorators import connection_try_decorator
+from policies import SchedulingPolicy, FairSharePolicy, POLICIES
+from chunking import AdaptiveChunkSize, CompletionBitmap
+from sessions import pool, OAUTH_HOST
+from ratelimit import limiter
+from journal import TransferJournal
+from checksums import StreamingDigest, parse_goog_hash, object_digests, matches
+from compression import CompressedStream, DecompressedFile
+from metrics import TransferStats, BYTES_TRANSFERRED, THROTTLED, CHECKSUM_MISMATCHES, ADMISSION_WAIT
 from datetime import datetime
-from time import sleep
-import logging
+from typing import Callable
+from time import perf_counter
+from threading import Condition, Event, Lock
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+import asyncio
+import atexit
+import logging
 import math
+import mmap
 import sys
 import os
 
+def retryable(status_code:int) -> bool:
+    #Server errors, timeouts and throttling may pass on a later try, other client errors will not
+    return status_code < 400 or status_code >= 500 or status_code in (408, 429)
+
+
 class Process:
+    logger = logging.getLogger("Computer")
     process_type:str = "process"
     burst_time:int = 0
     original_burst_time:int = 0
+    processed_time:int = 0
     sub_processed_time:int = 0
-    sub_wait_time:int = 0
+    service_time:float = 0 #seconds spent processing chunks
+    transferred:int = 0 #bytes done so far
+    enqueued_time:float = 0
+    deadline:float = None #absolute time, used by the edf policy
+    qos:str = "background" #"interactive" for transfers a user is waiting on, served first by the mlfq policy
+    operation:str = None #cloud path of the user operation the process belongs to, see Firebase.transfers
+    journaled:bool = True #False for parts of a bigger operation that the journal could not resume on their own
+    direction:str = None #bucket of the bandwidth limiter the process draws from
     process_id:int = 0
     completed_time:float = 0
     completed:bool = False
     error:bool = False
+    cancelled:bool = False
+    paused:bool = False #held by Computer.pause until resumed
+    materialized:bool = False
+    failures:int = 0 #failed chunks in a row
+    max_failures:int = 5
+    backoff:float = 1 #seconds before the chunk after a failed one, doubled after every further failure
+    retry_at:float = 0 #perf_counter time the next chunk waits for, see Computer.run_worker
 
     def __init__(self, user:User, priority:int=3):
         self.user = user
@@ -27,15 +62,16 @@ class Process:
         self.priority = priority
         self.process_id = Process.process_id
         Process.process_id += 1
+        #Set by the Computer once the process completed or failed
+        self.finished = Event()
 
     
-    def wait(self):
-        self.sub_wait_time += 1
+    def waited(self, now:float) -> float:
+        return now - self.enqueued_time
     
     def increase_priority(self):
         if (self.priority > 1):
             self.priority -= 1
-            self.sub_wait_time = 0
     
     def decrease_priority(self):
         if (self.priority < 3):
@@ -43,200 +79,837 @@ class Process:
             self.sub_processed_time = 0
 
     def process(self):
+        self.processed_time += 1
         self.sub_processed_time += 1
         self.burst_time -= 1
 
+    def rederive_burst(self, remaining:int, chunk_size:int):
+        #Burst is counted in chunks, so it has to follow the chunk size for SRTF to compare remaining work
+        self.burst_time = math.ceil(remaining / chunk_size)
+        self.original_burst_time = self.processed_time + self.burst_time
+
+    def fail(self, reason:str, retry:bool=True):
+        #Backs off before the next chunk, the process fails once it may not retry or ran out of tries
+        self.failures += 1
+        if (not retry or self.failures > self.max_failures):
+            self.logger.error(f"Process {self.process_id} type {self.process_type} failed after {self.failures} tries: {reason}")
+            self.error = True
+            return
+        self.retry_at = perf_counter() + self.backoff * 2 ** (self.failures - 1)
+
+    def succeed(self):
+        self.failures = 0
+        self.retry_at = 0
+
+    def materialize(self):
+        #Opens what the transfer needs (sessions, files). Deferred to its first chunk so a queued process is only a descriptor
+        self.materialized = True
+
+    def run_chunk(self):
+        if (self.error):
+            return
+        if (not self.materialized):
+            self.materialize()
+            if (self.error or not self.materialized):
+                return
+        self.process()
+
+    async def process_async(self, executor:ThreadPoolExecutor=None):
+        #One chunk as an awaitable. Blocking transfers run on the executor so the loop keeps dispatching other processes
+        await asyncio.get_running_loop().run_in_executor(executor, self.run_chunk)
+
     def is_completed(self) -> bool:
         return False
 
+    def close(self):
+        #Releases what the process holds, called by the Computer once it completed or failed and when it is paused
+        pass
+
+    def discard(self):
+        #Removes what a cancelled process leaves behind, called after close() and off the Computer lock
+        pass
+
+    def journal_entry(self) -> dict:
+        #What the transfer journal needs to resume the process after a restart, None for processes that are not resumable
+        return None
+
+    def wait_finished(self, timeout:float=None) -> bool:
+        self.finished.wait(timeout)
+        return self.is_completed()
+
 
 class DownloadProcess(Process):
     process_type:str = "download"
-    download_size:int = 1024
+    download_size:int = 16384 #starting size of each range, adapted to the measured latency
+    min_download_size:int = 16384 #also the block size of the completion bitmap
+    max_download_size:int = 8 * 1024 * 1024
+    parallel_ranges:int = 4 #ranges fetched at the same time for large objects
+    parallel_threshold:int = 8 * 1024 * 1024
+    range_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="range")
+    direction:str = "download"
+    checkpoint_interval:float = 2 #seconds between saves of the completion bitmap
+    checkpointed:float = 0
     current_downloaded:int = 0
+    total_size:int = 0
+    hashed:int = 0 #bytes fed to the digest, always a prefix of the file
+    handle = None
+    bitmap:CompletionBitmap = None
+    version:str = None #generation of the object, see CompletionBitmap
+    output:DecompressedFile = None
 
-    def __init__(self, download_link:str, user:User, file_name:str):
+    def __init__(self, download_link:str, user:User, file_name:str, codec:str=None):
         super().__init__(user)
         self.download_link = download_link
         self.file_name = file_name
-        try:
-            with open(f'{os.environ.get("CACHE_PATH")}/{file_name}', 'wb') as f:
-                f.write(b'')
-        except FileNotFoundError:
-            os.makedirs(f'{os.environ.get("CACHE_PATH")}/{"/".join(self.file_name.split("/")[:-1])}', exist_ok=True)
-            with open(f'{os.environ.get("CACHE_PATH")}/{file_name}', 'wb') as f:
-                f.write(b'')
-        r = requests.get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes=0-0"})
+        self.operation = file_name
+        self.codec = codec
+        self.path = f'{os.environ.get("CACHE_PATH")}/{file_name}'
+        #Ranges land next to the cached copy, which is only replaced once the new one checks out
+        self.temp_path = f'{self.path}.download'
+        self.bitmap_path = f'{self.path}.part'
+        if (codec):
+            #The object is downloaded as stored and decompressed into the cache in file order
+            try:
+                self.output = DecompressedFile(self.path, codec)
+            except ValueError as e:
+                #Fails before any request, the cached copy stays as it was
+                self.logger.error(f"Process {self.process_id} download of {file_name} can not be decompressed: {e}")
+                self.error = True
+        self.chunk_size = AdaptiveChunkSize(self.download_size, self.min_download_size, self.max_download_size, self.min_download_size)
+        self.download_size = self.chunk_size.size
+        self.digest = StreamingDigest()
+        self.pending:dict[int, bytes] = {} #ranges that arrived ahead of the hashed prefix
+        self.expected:dict[str, str] = {}
+        self.digests:dict[str, str] = {}
+        #A single chunk until the size is known
+        self.rederive_burst(self.download_size, self.download_size)
+
+    @connection_try_decorator
+    def materialize(self):
+        super().materialize()
+        r = pool.session(self.download_link).get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes=0-0"})
         if (r.ok):
-            total = r.headers.get("Content-Range").split("/")[1]
-            self.burst_time = math.ceil(int(total) / self.download_size)
-            self.original_burst_time = math.ceil(int(total) / self.download_size)
+            self.total_size = int(r.headers.get("Content-Range").split("/")[1])
+            #Ranged replies carry the hashes of the whole object
+            self.expected = parse_goog_hash(r.headers.get("x-goog-hash"))
+            self.version = r.headers.get("x-goog-generation") or r.headers.get("ETag") or r.headers.get("x-goog-hash")
+        elif (r.status_code != 416):
+            #416 only means the object is empty
+            self.materialized = False
+            self.fail(f"probe answered {r.status_code}", retryable(r.status_code))
+            return
+
+        #Keeps the progress of an interrupted download of the same object, otherwise preallocates a sparse file
+        self.bitmap = CompletionBitmap.load(self.bitmap_path, self.total_size, self.min_download_size, self.version)
+        if (not self.bitmap or not os.path.exists(self.temp_path)):
+            self.bitmap = CompletionBitmap(self.total_size, self.min_download_size, self.version)
+            os.makedirs(os.path.dirname(self.temp_path), exist_ok=True)
+            with open(self.temp_path, 'wb') as f:
+                f.truncate(self.total_size)
+        self.current_downloaded = self.bitmap.downloaded()
+        self.transferred = self.current_downloaded
+        self.ranges = self.parallel_ranges if (self.total_size >= self.parallel_threshold) else 1
+        self.rederive_burst(self.total_size - self.current_downloaded, self.download_size * self.ranges)
+
+    def fetch_range(self, first:int, last:int) -> tuple[int, int, bytes]:
+        #The status, the offset and the bytes of the range, the bytes are None when it failed
+        r = pool.session(self.download_link).get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes={first}-{last}"})
+        if (not r.ok):
+            return r.status_code, first, None
+        content = r.content if (r.status_code == 206) else r.content[first:last + 1]
+        if (len(content) != last - first + 1):
+            return r.status_code, first, None
+        return r.status_code, first, content
 
     @connection_try_decorator
     def process(self):
-        r = requests.get(self.download_link, headers={"Authorization": "Bearer "+self.user.idToken, "Range":f"bytes={self.current_downloaded}-{self.current_downloaded+self.download_size-1}"})
-        if (r.ok):
-            with open(f'{os.environ.get("CACHE_PATH")}/{self.file_name}', 'ab') as f:
-                f.write(r.content)
-            end, total = r.headers.get("Content-Range").split("-")[1].split("/")
-            self.current_downloaded = int(end) + 1
+        if (self.error):
+            return
+        start = perf_counter()
+        #A throttled download fetches fewer bytes this chunk rather than waiting in the middle of a request
+        wanted = self.download_size * self.ranges
+        granted = limiter.grant(self.direction, wanted, self.min_download_size, self.min_download_size)
+        count = max(1, min(self.ranges, granted // self.min_download_size))
+        ranges = self.bitmap.missing_ranges(count, granted // count)
+        fetches = [self.range_executor.submit(self.fetch_range, first, last) for first, last in ranges]
+        failed = []
+        fetched = 0
+        if (not self.handle):
+            self.handle = open(self.temp_path, 'r+b')
+        #Ranges are written at their own offset in whatever order they finish
+        for fetch in as_completed(fetches):
+            status, first, content = fetch.result()
+            if (content is None):
+                failed.append(status)
+                continue
+            fetched += len(content)
+            self.handle.seek(first)
+            self.handle.write(content)
+            self.bitmap.mark(first, first + len(content) - 1)
+            self.pending[first] = content
+        self.hash_ready()
+        #Progress is saved every few seconds instead of every chunk, a lost save only costs refetching those blocks
+        if (perf_counter() - self.checkpointed >= self.checkpoint_interval):
+            self.checkpoint()
+        limiter.consume(self.direction, fetched)
+        self.current_downloaded = self.bitmap.downloaded()
+        self.transferred = self.current_downloaded
+
+        if (failed):
+            self.download_size = self.chunk_size.decrease()
+            if (not all(retryable(status) for status in failed)):
+                self.fail(f"ranges answered {failed}", False)
+            elif (not fetched):
+                #A chunk that got nothing at all backs off, one that got some ranges carries on with a smaller window
+                self.fail(f"ranges answered {failed}")
+        else:
+            self.succeed()
             super().process()
-            if (self.current_downloaded >= int(total)):
-                self.completed = True
-                self.completed_time = datetime.now().timestamp()
+            if (granted >= wanted):
+                #The latency of a throttled chunk says nothing about the link
+                self.download_size = self.chunk_size.record(perf_counter() - start)
+        self.rederive_burst(self.total_size - self.current_downloaded, self.download_size * self.ranges)
+        if (self.bitmap.is_complete()):
+            self.digests = self.digest.digests()
+            self.close()
+            if (os.path.exists(self.bitmap_path)):
+                os.remove(self.bitmap_path)
+            if (not matches(self.digests, self.expected)):
+                #A corrupt copy is not kept, the cache keeps what it had and the next get_file downloads it again
+                self.logger.error(f"Process {self.process_id} download of {self.file_name} does not match the stored checksums.")
+                CHECKSUM_MISMATCHES.inc(process_type=self.process_type)
+                os.remove(self.temp_path)
+                if (self.output):
+                    self.output.discard()
+                self.error = True
+                return
+            if (self.output):
+                #The digests of a compressed object are of the stream, the cache keeps the ones of the file
+                intact = self.output.replace()
+                os.remove(self.temp_path)
+                if (not intact):
+                    self.logger.error(f"Process {self.process_id} download of {self.file_name} is a truncated {self.codec} stream.")
+                    self.error = True
+                    return
+                self.digests = self.output.digest.digests()
+            else:
+                os.replace(self.temp_path, self.path)
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
     
     def is_completed(self) -> bool:
         return self.completed
 
+    def hash_ready(self):
+        #Feeds the digest in file order. Ranges that arrived out of order wait in pending, blocks
+        #downloaded by an earlier run are read back from the file since their bytes never passed through here
+        while (self.hashed < self.total_size):
+            content = self.pending.pop(self.hashed, None)
+            if (content is None):
+                if (self.hashed // self.min_download_size not in self.bitmap):
+                    break
+                end = self.hashed
+                while (end < self.total_size and end - self.hashed < self.max_download_size and end not in self.pending and end // self.min_download_size in self.bitmap):
+                    end = min(end + self.min_download_size, self.total_size)
+                self.handle.flush()
+                self.handle.seek(self.hashed)
+                content = self.handle.read(end - self.hashed)
+            self.digest.update(content)
+            if (self.output):
+                self.output.write(content)
+            self.hashed += len(content)
+
+    def checkpoint(self):
+        #The data has to reach the file before the bitmap claims it
+        if (self.handle):
+            self.handle.flush()
+        self.bitmap.save(self.bitmap_path)
+        self.checkpointed = perf_counter()
+
+    def close(self):
+        if (self.handle):
+            if (not self.bitmap.is_complete()):
+                self.checkpoint()
+            self.handle.close()
+            self.handle = None
+        if (self.output and self.bitmap and not self.bitmap.is_complete()):
+            self.output.close()
+
+    def discard(self):
+        #The cached copy from before the download stays
+        for path in (self.temp_path, self.bitmap_path):
+            if (os.path.exists(path)):
+                os.remove(path)
+        if (self.output):
+            self.output.discard()
+
+    def journal_entry(self) -> dict:
+        #The offsets live in the bitmap next to the file, the journal only remembers to come back to it
+        if (not self.journaled):
+            return None
+        return {"type":"download", "user":self.user.localId, "cloud_path":self.file_name}
+
 
 class UploadProcess(Process):
     process_type:str = "upload"
-    upload_url:str
-    upload_size:int = 262144
+    upload_url:str = None
+    upload_size:int = 262144 #starting chunk size, adapted to the measured latency
+    upload_alignment:int = 262144 #resumable uploads only accept chunks in multiples of 256 KiB
+    max_upload_size:int = 16 * 1024 * 1024
     current_uploaded:int = 0
-    creds = service_account.Credentials.from_service_account_file('./cloudos-12cdc-firebase-adminsdk-fbsvc-9b35e8b6ff.json', scopes=["https://www.googleapis.com/auth/devstorage.full_control"])
+    handle = None
+    map:mmap.mmap = None
+    recovering:bool = False #the session has to be asked for its committed offset before the next chunk
+    hashed:int = 0 #bytes fed to the digest, always a prefix of the upload
+    source:CompressedStream = None #the compressed stream sent instead of the file when there is a codec
+    auth_request:google.auth.transport.requests.Request = None
+    direction:str = "upload"
+    creds:service_account.Credentials = None #loaded by the first upload that needs a token
+    creds_lock = Lock()
 
-    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str):
+    def __init__(self, firebase_bucket:str, user:User, file_name:str, file:str, upload_url:str=None, offset:int=0, object_name:str=None, codec:str=None):
         super().__init__(user)
         self.file_name = file_name
+        self.operation = file_name
+        self.object_name = object_name or f"files/{user.localId}/{file_name}"
+        self.codec = codec
         self.firebase_bucket = firebase_bucket
         self.file = file
         self.file_size = os.path.getsize(file)
-        self.burst_time = math.ceil(self.file_size / self.upload_size)
-        self.original_burst_time = math.ceil(self.file_size / self.upload_size)
-        self.creds.refresh(google.auth.transport.requests.Request())
-        self.access_token = self.creds.token
+        self.modified = os.path.getmtime(file)
+        self.chunk_size = AdaptiveChunkSize(self.upload_size, self.upload_alignment, self.max_upload_size, self.upload_alignment)
+        self.upload_size = self.chunk_size.size
+        self.digest = StreamingDigest()
+        self.digests:dict[str, str] = {}
+        if (upload_url):
+            #Resumes the session of an interrupted upload from its last acknowledged offset
+            self.upload_url = upload_url
+            self.current_uploaded = offset
+            self.transferred = offset
+            self.recovering = True
+        self.rederive_burst(self.remaining(), self.upload_size)
 
-        url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.firebase_bucket}/o?uploadType=resumable&name=files/{user.localId}/{self.file_name}"
+    @connection_try_decorator
+    def materialize(self):
+        super().materialize()
+        self.refresh_token()
+        if (self.upload_url):
+            return
+
+        url = f"https://storage.googleapis.com/upload/storage/v1/b/{self.firebase_bucket}/o?uploadType=resumable&name={self.object_name}"
         headers = {
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json; charset=UTF-8",
             "X-Upload-Content-Type": "application/octet-stream",
         }
-        result = requests.post(url, headers=headers)
+        result = pool.session(url).post(url, headers=headers)
         if (result.ok):
             self.upload_url = result.headers.get("Location")
         else:
             raise Exception("Failed to initiate upload session")
 
+    def refresh_token(self, rejected:bool=False):
+        #The token is shared by every upload and only refreshed once it expires, or once storage rejected it
+        #unless another upload already replaced it
+        with self.creds_lock:
+            if (not UploadProcess.creds):
+                UploadProcess.creds = service_account.Credentials.from_service_account_file('./cloudos-12cdc-firebase-adminsdk-fbsvc-9b35e8b6ff.json', scopes=["https://www.googleapis.com/auth/devstorage.full_control"])
+            if (not UploadProcess.auth_request):
+                #Kept alive on purpose, google-auth closes the session of a Request once it is garbage collected
+                UploadProcess.auth_request = google.auth.transport.requests.Request(session=pool.session(OAUTH_HOST))
+            if (not self.creds.valid or (rejected and self.creds.token == self.access_token)):
+                self.creds.refresh(self.auth_request)
+            self.access_token = self.creds.token
+
+    def open_file(self):
+        if (self.codec):
+            self.source = CompressedStream(self.file, self.codec)
+            self.handle = self.source.handle
+            return
+        #The source stays mapped for the lifetime of the process, chunks are zero-copy slices of it
+        self.handle = open(self.file, 'rb')
+        if (self.file_size > 0):
+            self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def remaining(self) -> int:
+        #Bytes of the file left to send. The offsets of a compressed upload count the stream, its
+        #progress through the file is what the stream compressed so far
+        if (self.codec):
+            return self.file_size - (self.source.consumed if (self.source) else 0)
+        return self.file_size - self.current_uploaded
+
+    def upload_total(self) -> int:
+        #Size of the object, None while the length of the compressed stream is still unknown
+        if (self.codec):
+            return self.source.total if (self.source) else None
+        return self.file_size
+
+    def read_chunk(self, size:int) -> memoryview:
+        if (self.source):
+            #Compressed as it is read, at most one chunk ahead of the session
+            return memoryview(self.source.read(self.current_uploaded, size))
+        return memoryview(self.map)[self.current_uploaded:self.current_uploaded + size] if (self.map) else memoryview(b'')
+
     @connection_try_decorator
     def process(self):
         if (self.upload_url):
-            with open(self.file, 'rb') as f:
-                f.seek(self.current_uploaded)
-                chunk = f.read(self.upload_size)
+            if (self.recovering):
+                #The last chunk may have been partly committed, so the session decides where to continue
+                self.recover()
+                return
+            if (not self.handle):
+                self.open_file()
+            #A throttled upload sends a smaller chunk rather than waiting in the middle of a request
+            size = limiter.grant(self.direction, self.upload_size, self.upload_alignment, self.upload_alignment)
+            chunk = self.read_chunk(size)
+            try:
                 if (not chunk):
+                    self.digests = self.source.raw_digest.digests() if (self.source) else self.digest.digests()
                     self.completed = True
                     return
+                total = self.upload_total()
                 headers = {
-                    "Content-Length": str(self.upload_size),
-                    "Content-Range": f"bytes {self.current_uploaded}-{self.current_uploaded + len(chunk) - 1}/{self.file_size}",
+                    "Content-Length": str(len(chunk)),
+                    "Content-Range": f"bytes {self.current_uploaded}-{self.current_uploaded + len(chunk) - 1}/{'*' if (total is None) else total}",
                     "Authorization": f"Bearer {self.access_token}"
                 }
 
-                result = requests.put(self.upload_url, headers=headers, data=chunk)
+                start = perf_counter()
+                try:
+                    result = pool.session(self.upload_url).put(self.upload_url, headers=headers, data=chunk)
+                except requests.RequestException:
+                    self.recovering = True
+                    self.upload_size = self.chunk_size.decrease()
+                    raise
+                limiter.consume(self.direction, len(chunk))
                 if (result.ok or result.status_code == 308):
-                    self.current_uploaded += len(chunk)
+                    #A 308 carries the committed range, which can be shorter than what was sent
+                    self.advance(self.committed_offset(result) if (result.status_code == 308) else None, result)
+                    self.succeed()
                     super().process()
-                    if (self.current_uploaded >= self.file_size):
-                        self.completed = True
-                        self.completed_time = datetime.now().timestamp()
-                    
+                    if (size >= self.upload_size):
+                        #The latency of a throttled chunk says nothing about the link
+                        self.upload_size = self.chunk_size.record(perf_counter() - start)
+                    self.rederive_burst(self.remaining(), self.upload_size)
+                else:
+                    self.recovering = True
+                    self.upload_size = self.chunk_size.decrease()
+                    self.rederive_burst(self.remaining(), self.upload_size)
+                    self.rejected(result)
+            finally:
+                #The map can only be closed once no slice of it is exported
+                chunk.release()
+                if (self.completed):
+                    self.close()
+
+    def committed_offset(self, result:requests.Response) -> int:
+        #"Range: bytes=0-N" means N + 1 bytes are committed, no header means none are
+        committed = result.headers.get("Range")
+        if (not committed):
+            return 0
+        return int(committed.split("-")[-1]) + 1
+
+    def advance(self, offset:int, result:requests.Response):
+        #offset is what the session committed, None once it holds the whole object.
+        #Committed bytes are hashed straight from the source, the ones before a resumed offset included
+        if (self.source):
+            #A resumed compressed upload regenerates the stream up to the committed offset
+            while (offset is None or self.hashed < offset):
+                committed = self.source.read(self.hashed, self.max_upload_size if (offset is None) else min(self.max_upload_size, offset - self.hashed))
+                if (not committed):
+                    break
+                self.digest.update(committed)
+                self.hashed += len(committed)
+                self.source.discard(self.hashed)
+            offset = self.hashed if (offset is None) else offset
+        else:
+            offset = self.file_size if (offset is None) else offset
+            if (offset > self.hashed and self.map):
+                committed = memoryview(self.map)[self.hashed:offset]
+                self.digest.update(committed)
+                committed.release()
+                self.hashed = offset
+        self.current_uploaded = offset
+        self.transferred = offset
+        total = self.upload_total()
+        if (total is not None and self.current_uploaded >= total):
+            #The object is checked against the digests of what was sent, the file entry records the ones of the file
+            self.digests = self.source.raw_digest.digests() if (self.source) else self.digest.digests()
+            try:
+                stored = object_digests(result.json())
+            except ValueError:
+                stored = {}
+            if (not matches(self.digest.digests(), stored)):
+                self.logger.error(f"Process {self.process_id} upload of {self.file_name} does not match the checksums of the stored object.")
+                CHECKSUM_MISMATCHES.inc(process_type=self.process_type)
+                self.error = True
+                return
+            self.completed = True
+            self.completed_time = datetime.now().timestamp()
+
+    def recover(self):
+        #Status query of the resumable session, only the bytes after its committed offset are sent again
+        total = self.upload_total()
+        headers = {
+            "Content-Length": "0",
+            "Content-Range": f"bytes */{'*' if (total is None) else total}",
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        result = pool.session(self.upload_url).put(self.upload_url, headers=headers)
+        if (result.ok or result.status_code == 308):
+            self.recovering = False
+            if (not self.handle):
+                self.open_file()
+            self.advance(self.committed_offset(result) if (result.status_code == 308) else None, result)
+            self.rederive_burst(self.remaining(), self.upload_size)
+            self.logger.info(f"Process {self.process_id} upload resumes at byte {self.current_uploaded}.")
+            if (self.completed):
+                self.close()
+        elif (result.status_code in (404, 410)):
+            #The session expired, the upload has to start over in a new one
+            self.logger.error(f"Process {self.process_id} upload session expired.")
+            self.error = True
+        else:
+            self.rejected(result)
+
+    def rejected(self, result:requests.Response):
+        #Failed chunk PUTs and status queries count together, so a session that answers the queries
+        #but keeps refusing the chunks still runs out of tries. A refused token is replaced first
+        if (result.status_code == 401):
+            self.refresh_token(rejected=True)
+        self.fail(f"storage answered {result.status_code}", retryable(result.status_code) or result.status_code == 401)
+
     def is_completed(self) -> bool:
         return self.completed
 
+    def close(self):
+        if (self.map):
+            self.map.close()
+            self.map = None
+        if (self.source):
+            self.source.close()
+            self.source = None
+        if (self.handle):
+            self.handle.close()
+            self.handle = None
+
+    def discard(self):
+        #Cancels the resumable session so storage drops the bytes it already received
+        if (not self.upload_url):
+            return
+        try:
+            pool.session(self.upload_url).delete(self.upload_url, headers={"Content-Length": "0"})
+        except requests.RequestException as e:
+            self.logger.error(f"Process {self.process_id} upload session could not be cancelled: {e}")
+
+    def journal_entry(self) -> dict:
+        if (not self.journaled):
+            return None
+        return {
+            "type":"upload", "user":self.user.localId, "cloud_path":self.file_name, "file":self.file,
+            "file_size":self.file_size, "modified":self.modified, "upload_url":self.upload_url, "offset":self.current_uploaded,
+            "object_name":self.object_name, "codec":self.codec
+        }
+
+
+class Worker:
+    def __init__(self, worker_id:int):
+        self.worker_id = worker_id
+        self.current_process:Process = None
+
 
 class Computer:
     logger = logging.getLogger("Computer")
-    multi_level_scheduling:dict[int, dict[str, list[Process]]] = {
-        1:{"queue":[]}, #FCFS
-        2:{"queue":[]}, #RR
-        3:{"queue":[]}  #SRTF
-    }
     settings:dict = {
-        "aging_time":10,
+        "policy":"mlfq", #one of policies.POLICIES
+        "aging_time":5, #seconds spent waiting in a level before being promoted
         "time_quantum":3,
-        "lower_priority_time":5
+        "lower_priority_time":5,
+        "wfq_weights":{}, #process type -> weight for the wfq policy
+        "default_deadline":60, #seconds after arrival for processes without a deadline under the edf policy
+        "interactive_deadline":2, #seconds after arrival for the reads get_file makes for a user waiting on them
+        "background_share":0.2, #bytes background processes still get under the mlfq policy while interactive ones wait
+        "fair_share":True, #shares the workers between users, each one scheduled by the policy above
+        "user_weights":{}, #user localId -> weight for the fair share
+        "user_max_transfers":None, #processes a single user may run at the same time
+        "user_max_rate":None, #bytes per second a single user may transfer
+        "max_upload_rate":None, #bytes per second for all uploads together
+        "max_download_rate":None, #bytes per second for all downloads together
+        "rate_burst":2, #seconds of the rate a transfer may use at once after being idle
+        "workers":4, #processes that are transferred at the same time
+        #Processes admitted at once, queued, running or paused. add_process blocks its caller until one
+        #finishes beyond that, None admits everything. Only the ones that started hold a session and a file
+        "max_in_flight":1024
     }
-    stats:list[tuple]
-    current_process:Process = None
+    policy:SchedulingPolicy
+    workers:list[Worker]
+    stats:TransferStats
+    journal:TransferJournal
+    loop:asyncio.AbstractEventLoop = None
     start_time:int = 0
 
-    def __init__(self):
+    def __init__(self, workers:int=None, clock:Callable[[], float]=None, policy:str=None, settings:dict=None):
+        if (settings):
+            self.settings = dict(self.settings, **settings)
+        #Scheduling decisions read the time through the clock so the simulator can run them on virtual time
+        self.clock = clock or (lambda: datetime.now().timestamp())
         logging.basicConfig(handlers=[logging.FileHandler("output.log", 'w')])
         self.logger.setLevel(logging.DEBUG)
-        self.stats = []
-        self.stat_offset = 0
+        self.policy = self.make_policy(policy or self.settings.get("policy"))
+        self.workers = [Worker(worker_id) for worker_id in range(workers or self.settings.get("workers"))]
+        self.stats = TransferStats()
+        self.journal = TransferJournal()
+        self.processes:dict[int, Process] = {} #added and not finished yet, by process_id
+        self.paused:dict[int, Process] = {}
+        for direction in limiter.directions:
+            if (self.settings.get(f"max_{direction}_rate")):
+                self.set_rate_limit(direction, self.settings.get(f"max_{direction}_rate"))
+        #Guards the queues, processes are added from the Firebase threads while the workers run on the event loop
+        self.lock = Lock()
+        #Producers wait on it for a free slot under max_in_flight
+        self.admission = Condition(self.lock)
+
+    @property
+    def current_processes(self) -> list[Process]:
+        return [worker.current_process for worker in self.workers if worker.current_process]
 
-    def add_process(self, process:Process):
-        self.multi_level_scheduling[process.priority]["queue"].append(process)
+    def make_policy(self, name:str) -> SchedulingPolicy:
+        if (self.settings.get("fair_share")):
+            return FairSharePolicy(self, POLICIES[name])
+        return POLICIES[name](self)
+
+    def set_policy(self, name:str):
+        #Switches the policy at runtime, queued processes move over and running ones follow after their chunk
+        with self.lock:
+            processes = self.policy.drain()
+            self.policy = self.make_policy(name)
+            for process in processes:
+                self.policy.add(process)
+        self.logger.info(f"Scheduling policy switched to {name}.")
+
+    def set_rate_limit(self, direction:str, rate:float):
+        #Bytes per second for "upload" or "download", None lifts the limit. Applies from the next chunk
+        self.settings = dict(self.settings, **{f"max_{direction}_rate":rate})
+        limiter.set_rate(direction, rate, rate * self.settings.get("rate_burst") if (rate) else None)
+        self.logger.info(f"{direction.capitalize()} rate limit set to {rate}.")
+
+    def has_room(self) -> bool:
+        limit = self.settings.get("max_in_flight")
+        return limit is None or len(self.processes) < limit
+
+    def add_process(self, process:Process, timeout:float=None) -> bool:
+        #Blocks while max_in_flight processes are admitted, False if timeout ran out first.
+        #Only for producer threads, the event loop waiting here would never free a slot
+        start = perf_counter()
+        with self.admission:
+            if (not self.admission.wait_for(self.has_room, timeout)):
+                self.logger.info(f"Process {process.process_id} type {process.process_type} not admitted, {len(self.processes)} in flight.")
+                return False
+            self.processes[process.process_id] = process
+            self.policy.add(process)
+        waited = perf_counter() - start
+        if (waited > 0.001):
+            ADMISSION_WAIT.inc(waited, process_type=process.process_type)
+        self.journal.record(process)
+        self.notify()
         self.logger.info(f"Process {process.process_id} type {process.process_type} added to priority {process.priority} queue.")
+        return True
+
+    def execute(self, process:Process) -> bool:
+        #Synchronous facade for callers running on their own thread, blocks until the process completed or failed
+        self.add_process(process)
+        return process.wait_finished()
+
+    def execute_all(self, processes:list[Process]) -> bool:
+        #Queues the processes together so they share the workers, blocks until all of them are done.
+        #Beyond max_in_flight the rest are admitted as the first ones finish
+        for process in processes:
+            self.add_process(process)
+        return all([process.wait_finished() for process in processes])
+
+    def get_processes(self, user_id:str=None) -> list[Process]:
+        #Processes that are queued, running or paused, of one user when user_id is given
+        with self.lock:
+            return [process for process in self.processes.values() if (user_id is None or process.user.localId == user_id)]
+
+    def cancel(self, process_id:int) -> bool:
+        #Stops a process for good. A queued or paused one finishes right away, a running one after its current chunk
+        with self.lock:
+            process = self.processes.get(process_id)
+            if (process is None):
+                return False
+            process.cancelled = True
+            process.error = True
+            if (process not in self.current_processes):
+                self.policy.remove(process)
+                self.finish(process)
+        self.notify()
+        self.logger.info(f"Process {process_id} type {process.process_type} cancelled.")
+        return True
+
+    def pause(self, process_id:int) -> bool:
+        #Takes a process off the queues and closes its files until resume(), a running one stops after its current chunk
+        with self.lock:
+            process = self.processes.get(process_id)
+            if (process is None or process.paused):
+                return False
+            process.paused = True
+            if (process not in self.current_processes):
+                self.policy.remove(process)
+                self.park(process)
+        self.logger.info(f"Process {process_id} type {process.process_type} paused.")
+        return True
+
+    def resume(self, process_id:int) -> bool:
+        with self.lock:
+            process = self.processes.get(process_id)
+            if (process is None or not process.paused):
+                return False
+            process.paused = False
+            #A running process that was not parked yet just carries on
+            if (self.paused.pop(process_id, None)):
+                self.policy.add(process)
+        self.notify()
+        self.logger.info(f"Process {process_id} type {process.process_type} resumed.")
+        return True
+
+    def reprioritize(self, process_id:int, priority:int=None, deadline:float=None) -> bool:
+        #Moves a process to another priority level (1 to 3) or deadline, a running one keeps them when it is requeued
+        with self.lock:
+            process = self.processes.get(process_id)
+            if (process is None):
+                return False
+            queued = process not in self.current_processes and process_id not in self.paused and self.policy.remove(process)
+            if (priority is not None):
+                process.priority = min(3, max(1, priority))
+                process.sub_processed_time = 0
+            if (deadline is not None):
+                process.deadline = deadline
+            if (queued):
+                self.policy.add(process)
+        self.notify()
+        self.logger.info(f"Process {process_id} type {process.process_type} reprioritized to priority {process.priority}.")
+        return True
+
+    def park(self, process:Process):
+        self.paused[process.process_id] = process
+        process.close()
+
+    def notify(self):
+        #Wakes the idle workers, safe to call from any thread
+        if (self.loop):
+            self.loop.call_soon_threadsafe(self.wakeup.set)
 
     def run(self):
+        #Whatever the journal still holds in memory is written when the app exits
+        atexit.register(self.journal.flush)
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        self.wakeup = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=len(self.workers), thread_name_prefix="transfer")
+        self.loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(*(self.run_worker(worker) for worker in self.workers))
+        finally:
+            self.loop = None
+            self.executor.shutdown(wait=False)
+
+    async def run_worker(self, worker:Worker):
         while True:
-            #Resets stats every minute
-            if (datetime.now().timestamp() - self.stat_offset >= 60 * 1):
-                self.stats.clear()
-                self.stat_offset = datetime.now().timestamp()
-
-            #Waiting and Aging
-            for priority in range(1, 4):
-                for process in self.multi_level_scheduling[priority]["queue"]:
-                    process.wait()
-                    if (process.sub_wait_time >= self.settings.get("aging_time") and process.priority > 1):
-                        process.increase_priority()
-                        self.multi_level_scheduling[priority]["queue"].remove(process)
-                        self.multi_level_scheduling[process.priority]["queue"].append(process)
-                        self.logger.info(f"Process {process.process_id} type {process.process_type} aged to priority {process.priority}.")
-            
-            #Processing the current process
-            if (self.current_process):
-                self.current_process.process()
-                if (self.current_process.error):
-                    self.current_process = self.select_from_mlfq()
-                elif (self.current_process.is_completed()):
-                    self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} finished processing")
-                    turn_around_time = self.current_process.completed_time - self.current_process.arrival_time
-                    waiting_time = turn_around_time - self.current_process.original_burst_time
-                    self.stats.append((self.current_process.arrival_time, turn_around_time, waiting_time))
-                    self.current_process = self.select_from_mlfq()
-                elif (self.current_process.priority == 3):
-                    if (self.multi_level_scheduling[2]["queue"] or self.multi_level_scheduling[1]["queue"]):
-                        self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} preempted.")
-                        if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                            self.current_process.decrease_priority()
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                        self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                        self.current_process = self.select_from_mlfq()
-                    elif (self.multi_level_scheduling[3]["queue"]):
-                        self.multi_level_scheduling[3]["queue"].sort(key=lambda p: p.burst_time)
-                        if (self.multi_level_scheduling[3]["queue"][0].burst_time < self.current_process.burst_time):
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} preempted.")
-                            if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                                self.current_process.decrease_priority()
-                                self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                            self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                            self.current_process = self.select_from_mlfq()
-                elif (self.current_process.priority == 2):
-                    if (self.current_process.sub_processed_time % self.settings.get("time_quantum") == 0):
-                        self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} time quantum expired.")
-                        if (self.current_process.sub_processed_time >= self.settings.get("lower_priority_time")):
-                            self.current_process.decrease_priority()
-                            self.logger.info(f"Process {self.current_process.process_id} type {self.current_process.process_type} lower to priority {self.current_process.priority}")
-                        self.multi_level_scheduling[self.current_process.priority]["queue"].append(self.current_process)
-                        self.current_process = self.select_from_mlfq()
+            with self.lock:
+                self.schedule(worker)
+                if (not worker.current_process):
+                    #Cleared under the lock so a process added right after is never missed
+                    self.wakeup.clear()
+                    retry_after = self.policy.retry_after()
+
+            #Sleeps until there is a process for this worker instead of polling, or until a held back one may run
+            if (not worker.current_process):
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), retry_after)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            #The chunk is awaited outside of the lock so other workers and add_process are never blocked by a transfer
+            process = worker.current_process
+            #Waits between chunks while the bandwidth limiter is in debt, no connection is held meanwhile
+            delay = limiter.delay(process.direction) if (process.direction) else 0
+            if (delay > 0):
+                THROTTLED.inc(delay, direction=process.direction)
+            #So does a process backing off after a failed chunk, on the loop rather than on an executor thread
+            delay = max(delay, process.retry_at - perf_counter())
+            if (delay > 0):
+                await asyncio.sleep(delay)
+            if (process.error or process.paused):
+                #Cancelled or paused while it waited
+                continue
+            priority = process.priority
+            transferred = process.transferred
+            start = perf_counter()
+            try:
+                await process.process_async(self.executor)
+            except Exception as e:
+                self.logger.error(f"Process {process.process_id} type {process.process_type} failed: {e}")
+                process.error = True
+            self.record_chunk(process, priority, perf_counter() - start, process.transferred - transferred)
+
+    def record_chunk(self, process:Process, priority:int, elapsed:float, transferred:int):
+        self.journal.record(process)
+        self.journal.checkpoint()
+        process.service_time += elapsed
+        self.stats.record("chunk_latency", process.process_type, priority, elapsed, self.clock())
+        if (transferred > 0):
+            BYTES_TRANSFERRED.inc(transferred, process_type=process.process_type)
+            if (elapsed > 0):
+                self.stats.record("throughput", process.process_type, priority, transferred / elapsed, self.clock())
+
+    def finish(self, process:Process):
+        self.policy.finished(process)
+        self.processes.pop(process.process_id, None)
+        self.paused.pop(process.process_id, None)
+        self.admission.notify()
+        process.close()
+        if (process.cancelled and not process.is_completed()):
+            #Cancelling may take a request of its own, so it runs off the lock
+            if (self.loop):
+                self.executor.submit(process.discard)
             else:
-                self.current_process = self.select_from_mlfq()
-            sleep(0.5)
-    
-    def select_from_mlfq(self) -> Process:
-        for priority in range(1, 4):
-            queue = self.multi_level_scheduling[priority]["queue"]
-            if (len(queue) > 0):
-                process = queue.pop(0)
-                self.logger.info(f"Process {process.process_id} type {process.process_type} selected from priority {priority} queue.")
-                process.sub_wait_time = 0
-                return process
-        return None
+                process.discard()
+        self.journal.remove(process)
+        self.journal.checkpoint()
+        process.finished.set()
+
+    def schedule(self, worker:Worker):
+        #Picking what runs next on this worker based on the chunk that was just processed
+        process = worker.current_process
+        if (process):
+            if (process.error):
+                #The last chunk counts towards the user's share and rate like every other one
+                self.policy.charge(process)
+                self.finish(process)
+                worker.current_process = self.policy.select(worker)
+            elif (process.is_completed()):
+                self.policy.charge(process)
+                self.logger.info(f"Process {process.process_id} type {process.process_type} finished processing on worker {worker.worker_id}")
+                turn_around_time = process.completed_time - process.arrival_time
+                waiting_time = max(0, turn_around_time - process.service_time)
+                self.stats.record("turnaround", process.process_type, process.priority, turn_around_time, self.clock())
+                self.stats.record("waiting", process.process_type, process.priority, waiting_time, self.clock())
+                self.finish(process)
+                worker.current_process = self.policy.select(worker)
+            elif (process.paused):
+                self.policy.charge(process)
+                self.policy.finished(process)
+                self.park(process)
+                worker.current_process = self.policy.select(worker)
+            else:
+                self.policy.charge(process)
+                if (self.policy.should_preempt(process)):
+                    self.policy.requeue(process)
+                    worker.current_process = self.policy.select(worker)
+        else:
+            worker.current_process = self.policy.select(worker)
 
 
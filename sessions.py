@@ -0,0 +1,82 @@
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from threading import Lock, Thread
+import requests
+
+STORAGE_HOST = "https://storage.googleapis.com"
+FIREBASE_STORAGE_HOST = "https://firebasestorage.googleapis.com"
+OAUTH_HOST = "https://oauth2.googleapis.com"
+
+
+class SessionPool:
+    """Process-wide keep-alive sessions, one per host, so every chunk and metadata
+    call reuses an open TCP + TLS connection instead of opening a new one."""
+
+    def __init__(self, pool_maxsize:int=16, max_retries:int=3):
+        self.pool_maxsize = pool_maxsize
+        #mount() replaces the adapter of pyrebase's session, which pyrebase sets up with 3 retries on App Engine.
+        #The retries also cover requests sent on a keep-alive connection the server closed while it was idle
+        self.max_retries = max_retries
+        self.sessions:dict[str, requests.Session] = {}
+        self.adapters:dict[str, HTTPAdapter] = {}
+        self.mounted:list[tuple[requests.Session, str]] = []
+        self.lock = Lock()
+
+    def host(self, url:str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def adapter(self, url:str) -> HTTPAdapter:
+        host = self.host(url)
+        with self.lock:
+            adapter = self.adapters.get(host)
+            if (not adapter):
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=self.max_retries)
+                self.adapters[host] = adapter
+            return adapter
+
+    def session(self, url:str) -> requests.Session:
+        host = self.host(url)
+        adapter = self.adapter(url)
+        with self.lock:
+            session = self.sessions.get(host)
+            if (not session):
+                session = requests.Session()
+                session.mount(f"{host}/", adapter)
+                self.sessions[host] = session
+            return session
+
+    def mount(self, session:requests.Session, url:str):
+        #Lets a session created elsewhere (pyrebase) share the connections of the host
+        session.mount(f"{self.host(url)}/", self.adapter(url))
+        with self.lock:
+            self.mounted.append((session, url))
+
+    def configure(self, pool_maxsize:int):
+        #Applies to connections opened after the call, the old pools are closed once idle
+        with self.lock:
+            self.pool_maxsize = pool_maxsize
+            adapters = list(self.adapters.values())
+            self.adapters.clear()
+            self.sessions.clear()
+            mounted = list(self.mounted)
+        for adapter in adapters:
+            adapter.close()
+        for session, url in mounted:
+            session.mount(f"{self.host(url)}/", self.adapter(url))
+
+    def prewarm(self, urls:list[str]):
+        #Opens one connection per host in the background so the first transfer skips the handshake
+        def warm():
+            for url in urls:
+                try:
+                    self.session(url).head(f"{self.host(url)}/", timeout=10)
+                except requests.RequestException:
+                    pass
+        Thread(target=warm, daemon=True).start()
+
+    def close(self):
+        self.configure(self.pool_maxsize)
+
+
+pool = SessionPool()
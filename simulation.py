@@ -0,0 +1,193 @@
+from scheduling import Computer, Process, Worker
+from objects import User
+from typing import Callable
+import heapq
+import random
+import math
+import sys
+
+#Discrete-event simulator for the Computer scheduler. Synthetic processes are driven on
+#a virtual clock through the same schedule()/record_chunk() calls the real workers make,
+#so a workload of hours runs in well under a second with no sleeps or network.
+
+STARVATION_TIME = 120 #virtual seconds of waiting that count as starving
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class SimulatedProcess(Process):
+    process_type:str = "simulated"
+
+    def __init__(self, clock:VirtualClock, chunks:int, chunk_bytes:int, chunk_time:float, process_type:str=None, user:User=None, qos:str=None):
+        super().__init__(user)
+        self.clock = clock
+        self.arrival_time = clock()
+        self.chunk_bytes = chunk_bytes
+        self.chunk_time = chunk_time
+        self.burst_time = chunks
+        self.original_burst_time = chunks
+        if (process_type):
+            self.process_type = process_type
+        if (qos):
+            self.qos = qos
+
+    def process(self):
+        super().process()
+        self.transferred += self.chunk_bytes
+        if (self.burst_time <= 0):
+            self.completed = True
+            self.completed_time = self.clock()
+
+    def is_completed(self) -> bool:
+        return self.completed
+
+
+#Workloads are lists of (arrival time, chunks, chunk time, process type[, user[, qos]])
+def many_small(rng:random.Random) -> list[tuple]:
+    return [(rng.uniform(0, 60), rng.randint(1, 4), rng.uniform(0.05, 0.2), "upload") for _ in range(500)]
+
+def few_huge(rng:random.Random) -> list[tuple]:
+    huge = [(rng.uniform(0, 5), rng.randint(1500, 2500), rng.uniform(0.1, 0.3), "upload") for _ in range(4)]
+    small = [(rng.uniform(0, 300), rng.randint(1, 8), rng.uniform(0.05, 0.2), "download") for _ in range(60)]
+    return huge + small
+
+def bursts(rng:random.Random) -> list[tuple]:
+    workload = []
+    for burst in range(10):
+        start = burst * 45
+        workload += [(start + rng.uniform(0, 2), rng.randint(1, 40), rng.uniform(0.05, 0.3), rng.choice(["upload", "download"])) for _ in range(40)]
+    return workload
+
+def mixed(rng:random.Random) -> list[tuple]:
+    return many_small(rng)[:200] + few_huge(rng)[:2] + bursts(rng)[:120]
+
+def shared(rng:random.Random) -> list[tuple]:
+    #One user uploads a big folder while two others keep opening small files
+    users = [User(f"user{number}@cloudos", "") for number in range(3)]
+    folder = [(rng.uniform(0, 2), rng.randint(200, 400), rng.uniform(0.1, 0.3), "upload", users[0]) for _ in range(30)]
+    opens = [(rng.uniform(0, 600), rng.randint(1, 6), rng.uniform(0.05, 0.2), "download", rng.choice(users[1:])) for _ in range(120)]
+    return folder + opens
+
+def editor(rng:random.Random) -> list[tuple]:
+    #A background sync keeps every worker busy while the user opens files in the editor
+    user = User("editor@cloudos", "")
+    sync = [(rng.uniform(0, 30), rng.randint(100, 300), rng.uniform(0.1, 0.3), "upload", user) for _ in range(40)]
+    opens = [(rng.uniform(0, 600), rng.randint(1, 6), rng.uniform(0.05, 0.2), "download", user, "interactive") for _ in range(60)]
+    return sync + opens
+
+
+WORKLOADS:dict[str, Callable[[random.Random], list[tuple]]] = {
+    "many_small":many_small,
+    "few_huge":few_huge,
+    "bursts":bursts,
+    "mixed":mixed,
+    "shared":shared,
+    "editor":editor
+}
+
+
+def simulate(workload:list[tuple], settings:dict=None, workers:int=None, chunk_bytes:int=262144) -> dict:
+    clock = VirtualClock()
+    #Arrivals are added on the same thread that finishes processes, so admission can not be bounded here
+    computer = Computer(workers, clock=clock, settings=dict({"max_in_flight":None}, **(settings or {})))
+    logger_disabled = computer.logger.disabled
+    computer.logger.disabled = True
+
+    #Events are (time, sequence, kind, payload), chunk ends are handled before arrivals and wake ups at the same time
+    events = []
+    sequence = 0
+    for arrival, chunks, chunk_time, process_type, *extra in workload:
+        events.append((arrival, sequence, 1, (chunks, chunk_time, process_type, *(extra + [None, None])[:2])))
+        sequence += 1
+    heapq.heapify(events)
+    processes:list[SimulatedProcess] = []
+    idle:list[Worker] = list(computer.workers)
+    wake_pending = False
+
+    try:
+        while (events):
+            clock.now, _, kind, payload = heapq.heappop(events)
+            if (kind == 1):
+                chunks, chunk_time, process_type, user, qos = payload
+                process = SimulatedProcess(clock, chunks, chunk_bytes, chunk_time, process_type, user, qos)
+                processes.append(process)
+                computer.add_process(process)
+            elif (kind == 2):
+                wake_pending = False
+            else:
+                worker, process, priority = payload
+                process.process()
+                computer.record_chunk(process, priority, process.chunk_time, process.chunk_bytes)
+                idle.append(worker)
+
+            #Same order as Computer.run_worker: schedule after every chunk, then start the next one
+            still_idle = []
+            for worker in idle:
+                with computer.lock:
+                    computer.schedule(worker)
+                process = worker.current_process
+                if (process):
+                    heapq.heappush(events, (clock.now + process.chunk_time, sequence, 0, (worker, process, process.priority)))
+                    sequence += 1
+                else:
+                    still_idle.append(worker)
+            idle = still_idle
+            #Workers left idle by a rate limit are woken like Computer.run_worker does after retry_after
+            retry_after = computer.policy.retry_after()
+            if (idle and retry_after is not None and not wake_pending):
+                heapq.heappush(events, (clock.now + retry_after, sequence, 2, None))
+                sequence += 1
+                wake_pending = True
+    finally:
+        computer.logger.disabled = logger_disabled
+
+    return report(processes, computer, clock)
+
+
+def report(processes:list[SimulatedProcess], computer:Computer, clock:VirtualClock) -> dict:
+    finished = [process for process in processes if (process.is_completed())]
+    turnarounds = sorted(process.completed_time - process.arrival_time for process in finished)
+    waits = [process.completed_time - process.arrival_time - process.service_time for process in finished]
+    #Jain's index over slowdown (turnaround / service), 1.0 means every process was slowed down equally
+    slowdowns = [(process.completed_time - process.arrival_time) / process.service_time for process in finished if (process.service_time > 0)]
+    fairness = sum(slowdowns) ** 2 / (len(slowdowns) * sum(s * s for s in slowdowns)) if (slowdowns) else None
+    makespan = clock.now - min((process.arrival_time for process in processes), default=0)
+    return {
+        "processes":len(processes),
+        "completed":len(finished),
+        "makespan":makespan,
+        "throughput":sum(process.transferred for process in processes) / makespan if (makespan) else 0,
+        "mean_turnaround":sum(turnarounds) / len(turnarounds) if (turnarounds) else None,
+        "p99_turnaround":turnarounds[max(0, math.ceil(0.99 * len(turnarounds)) - 1)] if (turnarounds) else None,
+        "max_wait":max(waits, default=None),
+        "starved":sum(1 for wait in waits if (wait >= STARVATION_TIME)),
+        "fairness":fairness
+    }
+
+
+def run(settings:dict=None, workers:int=None, seed:int=0) -> dict[str, dict]:
+    return {name:simulate(workload(random.Random(seed)), settings, workers) for name, workload in WORKLOADS.items()}
+
+
+def print_report(results:dict[str, dict]):
+    print(f"{'workload':<12}{'done':>10}{'MB/s':>8}{'mean tat':>10}{'p99 tat':>10}{'max wait':>10}{'starved':>9}{'fairness':>10}")
+    for name, result in results.items():
+        print(f"{name:<12}{result['completed']:>5}/{result['processes']:<4}{result['throughput'] / 1e6:>8.2f}"
+              f"{result['mean_turnaround']:>10.1f}{result['p99_turnaround']:>10.1f}{result['max_wait']:>10.1f}"
+              f"{result['starved']:>9}{result['fairness']:>10.3f}")
+
+
+if __name__ == "__main__":
+    #python simulation.py [aging_time] [time_quantum] [lower_priority_time] [workers] [policy]
+    names = ["aging_time", "time_quantum", "lower_priority_time"]
+    settings = {name:float(value) for name, value in zip(names, sys.argv[1:4])}
+    workers = int(sys.argv[4]) if (len(sys.argv) > 4) else None
+    if (len(sys.argv) > 5):
+        settings["policy"] = sys.argv[5]
+    print_report(run(settings, workers))
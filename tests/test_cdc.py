@@ -0,0 +1,47 @@
+from cdc import MIN_CHUNK, MAX_CHUNK, cut_point, chunk_ranges, manifest
+import random
+
+
+def data(size:int, seed:int=0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+
+def test_ranges_cover_the_data_within_the_chunk_limits():
+    content = data(2 * 1024 * 1024)
+    ranges = list(chunk_ranges(content))
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(content)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges[:-1]:
+        assert MIN_CHUNK <= end - start <= MAX_CHUNK
+
+
+def test_cut_point_only_depends_on_the_content():
+    content = data(1024 * 1024)
+    first = cut_point(content, 0, len(content))
+    #The same bytes at another offset are cut at the same place
+    shifted = data(1000, seed=1) + content
+    assert cut_point(shifted, 1000, len(shifted)) == first + 1000
+
+
+def test_short_data_is_a_single_chunk():
+    assert cut_point(b"x" * MIN_CHUNK, 0, MIN_CHUNK) == MIN_CHUNK
+    assert list(chunk_ranges(b"")) == []
+
+
+def test_manifest_is_stable_around_an_edit():
+    content = data(2 * 1024 * 1024)
+    edited = content[:1024 * 1024] + b"edited" + content[1024 * 1024:]
+    before = manifest(content)
+    after = manifest(edited)
+    assert manifest(content) == before
+    assert after["size"] == len(edited)
+    #Only the chunks around the edit change
+    unchanged = {chunk for chunk, _ in before["chunks"]} & {chunk for chunk, _ in after["chunks"]}
+    assert len(unchanged) >= len(before["chunks"]) - 2
+
+
+def test_manifest_keeps_the_digests():
+    result = manifest(b"hello", {"crc32c":"a", "md5":"b"})
+    assert result["crc32c"] == "a" and result["md5"] == "b"
+    assert result["chunks"] == [["2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824", 5]]
@@ -0,0 +1,39 @@
+from checksums import StreamingDigest, parse_goog_hash, object_digests, matches
+from base64 import b64encode
+import google_crc32c
+import hashlib
+import os
+
+
+def test_streaming_digest_matches_hashing_the_whole_file():
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    digest = StreamingDigest()
+    digest.piece = 1000
+    #Fed in uneven slices and memoryviews like the upload map hands them out
+    for start in range(0, len(data), 700000):
+        digest.update(memoryview(data)[start:start + 700000])
+    assert digest.length == len(data)
+    assert digest.digests() == {
+        "crc32c":b64encode(google_crc32c.Checksum(data).digest()).decode("ascii"),
+        "md5":b64encode(hashlib.md5(data).digest()).decode("ascii")
+    }
+
+
+def test_parse_goog_hash():
+    assert parse_goog_hash("crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ==") == {"crc32c":"n03x6A==", "md5":"Ojk9c3dhfxgoKVVHYwFbHQ=="}
+    assert parse_goog_hash(None) == {}
+
+
+def test_object_digests_skip_missing_fields():
+    assert object_digests({"crc32c":"n03x6A==", "md5Hash":"Ojk9c3dhfxgoKVVHYwFbHQ=="}) == {"crc32c":"n03x6A==", "md5":"Ojk9c3dhfxgoKVVHYwFbHQ=="}
+    #Composite objects carry no md5
+    assert object_digests({"crc32c":"n03x6A=="}) == {"crc32c":"n03x6A=="}
+
+
+def test_matches_compares_the_digests_both_sides_have():
+    digest = StreamingDigest()
+    digest.update(b"hello")
+    digests = digest.digests()
+    assert matches(digests, digests)
+    assert matches(digests, {"crc32c":digests["crc32c"]})
+    assert not matches(digests, {"crc32c":digests["crc32c"], "md5":"AAAA"})
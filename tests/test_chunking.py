@@ -0,0 +1,57 @@
+from chunking import AdaptiveChunkSize, CompletionBitmap
+
+
+def test_missing_ranges_skip_downloaded_blocks():
+    bitmap = CompletionBitmap(10 * 100 + 50, 100)
+    bitmap.mark(0, 199)
+    bitmap.mark(500, 599)
+    assert bitmap.missing_ranges(4, 300) == [(200, 499), (600, 899), (900, 1049)]
+    assert bitmap.missing_ranges(1, 100) == [(200, 299)]
+
+
+def test_downloaded_counts_the_short_last_block():
+    bitmap = CompletionBitmap(1050, 100)
+    bitmap.mark(1000, 1049)
+    assert bitmap.downloaded() == 50
+    bitmap.mark(0, 999)
+    assert bitmap.downloaded() == 1050
+    assert bitmap.is_complete() and bitmap.missing_ranges(4, 1000) == []
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "file.part")
+    bitmap = CompletionBitmap(1000, 100, "1700000000000001")
+    bitmap.mark(0, 299)
+    bitmap.mark(700, 799)
+    bitmap.save(path)
+    loaded = CompletionBitmap.load(path, 1000, 100, "1700000000000001")
+    assert loaded.bits == bitmap.bits
+    assert loaded.first_missing == 3
+    assert 7 in loaded and 6 not in loaded
+
+
+def test_load_rejects_another_object(tmp_path):
+    path = str(tmp_path / "file.part")
+    CompletionBitmap(1000, 100, "1").save(path)
+    assert CompletionBitmap.load(path, 2000, 100, "1") is None
+    assert CompletionBitmap.load(path, 1000, 200, "1") is None
+    assert CompletionBitmap.load(str(tmp_path / "missing.part"), 1000, 100, "1") is None
+
+
+def test_load_rejects_another_version_of_the_object(tmp_path):
+    path = str(tmp_path / "file.part")
+    CompletionBitmap(1000, 100, "1").save(path)
+    #Same size and block size, but the object was overwritten since
+    assert CompletionBitmap.load(path, 1000, 100, "2") is None
+    assert CompletionBitmap.load(path, 1000, 100) is None
+    CompletionBitmap(1000, 100).save(path)
+    assert CompletionBitmap.load(path, 1000, 100) is None
+
+
+def test_chunk_size_grows_and_halves():
+    size = AdaptiveChunkSize(256, 256, 4096, 256)
+    assert size.record(1.0) == 512
+    assert size.record(1.0) == 1024
+    assert size.decrease() == 512
+    #Past the size that misbehaved it only grows by a step
+    assert size.record(1.0) == 768
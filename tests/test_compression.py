@@ -0,0 +1,82 @@
+from compression import CompressedStream, DecompressedFile, choose_codec, default_codec, supported
+from checksums import StreamingDigest
+import random
+import pytest
+
+CODECS = [codec for codec in ("zlib", "zstd") if (supported(codec))]
+
+
+def text(size:int) -> bytes:
+    words = [b"alpha", b"beta", b"gamma", b"delta", b"cloud", b"file"]
+    rng = random.Random(0)
+    return b" ".join(rng.choice(words) for _ in range(size // 5))[:size]
+
+
+def compressed(path:str, codec:str, read_size:int) -> tuple[bytes, CompressedStream]:
+    stream = CompressedStream(path, codec)
+    data = b""
+    while (True):
+        chunk = stream.read(len(data), read_size)
+        if (not chunk):
+            break
+        data += chunk
+        stream.discard(len(data))
+    return data, stream
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_round_trip(tmp_path, codec):
+    content = text(3 * 1024 * 1024)
+    source = tmp_path / "notes.txt"
+    source.write_bytes(content)
+    data, stream = compressed(str(source), codec, 256 * 1024)
+    stream.close()
+    assert stream.total == len(data) < len(content)
+    digest = StreamingDigest()
+    digest.update(content)
+    assert stream.raw_digest.digests() == digest.digests()
+
+    output = DecompressedFile(str(tmp_path / "cache" / "notes.txt"), codec)
+    for start in range(0, len(data), 100_000):
+        output.write(data[start:start + 100_000])
+    assert output.replace()
+    assert (tmp_path / "cache" / "notes.txt").read_bytes() == content
+    assert output.digest.digests() == digest.digests()
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_stream_is_deterministic(tmp_path, codec):
+    source = tmp_path / "notes.txt"
+    source.write_bytes(text(2 * 1024 * 1024))
+    first, _ = compressed(str(source), codec, 256 * 1024)
+    second, _ = compressed(str(source), codec, 1024 * 1024)
+    assert first == second
+
+
+def test_truncated_stream_is_not_kept(tmp_path):
+    source = tmp_path / "notes.txt"
+    source.write_bytes(text(100_000))
+    data, _ = compressed(str(source), "zlib", 1024 * 1024)
+    output = DecompressedFile(str(tmp_path / "notes.out"), "zlib")
+    output.write(data[:len(data) // 2])
+    assert not output.replace()
+    assert not (tmp_path / "notes.out").exists()
+
+
+def test_choose_codec(tmp_path):
+    notes = tmp_path / "notes.txt"
+    notes.write_bytes(text(100_000))
+    noise = tmp_path / "noise.txt"
+    noise.write_bytes(random.Random(0).randbytes(100_000))
+    photo = tmp_path / "photo.png"
+    photo.write_bytes(text(100_000))
+    assert choose_codec(str(notes), "zlib") == "zlib"
+    assert choose_codec(str(noise), "zlib") is None
+    assert choose_codec(str(photo), "zlib") is None
+
+
+def test_unsupported_codec(tmp_path):
+    #Whatever is installed, uploads default to a codec every machine can read
+    assert default_codec() == "zlib"
+    with pytest.raises(ValueError):
+        DecompressedFile(str(tmp_path / "notes.txt"), "lz4")
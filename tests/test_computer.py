@@ -0,0 +1,136 @@
+from scheduling import Computer
+from simulation import SimulatedProcess, VirtualClock
+from objects import User
+from threading import Thread
+import pytest
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    #The Computer logs to output.log in the working directory and journals under CACHE_PATH
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CACHE_PATH", str(tmp_path))
+    return VirtualClock()
+
+
+def make_process(clock:VirtualClock, chunks:int=3, user:User=None) -> SimulatedProcess:
+    return SimulatedProcess(clock, chunks, 1024, 0.1, user=user or User("a@cloudos", ""))
+
+
+def test_add_process_times_out_beyond_max_in_flight(clock):
+    computer = Computer(1, clock=clock, settings={"max_in_flight":2})
+    first, second, third = (make_process(clock) for _ in range(3))
+    assert computer.add_process(first)
+    assert computer.add_process(second)
+    assert not computer.add_process(third, timeout=0.05)
+    assert len(computer.get_processes()) == 2
+
+
+def test_blocked_producer_is_admitted_once_a_process_finishes(clock):
+    computer = Computer(1, clock=clock, settings={"max_in_flight":1})
+    first, second = make_process(clock, chunks=1), make_process(clock)
+    computer.add_process(first)
+    admitted = []
+    producer = Thread(target=lambda: admitted.append(computer.add_process(second, timeout=5)))
+    producer.start()
+    worker = computer.workers[0]
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is first
+    first.process()
+    with computer.lock:
+        computer.schedule(worker)
+    producer.join()
+    assert admitted == [True]
+    assert first.finished.is_set()
+    #The slot frees up under the lock, so the producer only gets in after this round of scheduling
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is second
+
+
+def test_unbounded_admission(clock):
+    computer = Computer(1, clock=clock, settings={"max_in_flight":None})
+    for _ in range(50):
+        assert computer.add_process(make_process(clock), timeout=0)
+    assert len(computer.policy) == 50
+
+
+class Discarded(SimulatedProcess):
+    discarded:bool = False
+
+    def discard(self):
+        self.discarded = True
+
+
+def test_cancel_queued_process_finishes_it_right_away(clock):
+    computer = Computer(1, clock=clock)
+    process = Discarded(clock, 3, 1024, 0.1, user=User("a@cloudos", ""))
+    computer.add_process(process)
+    assert computer.cancel(process.process_id)
+    assert process.finished.is_set() and process.error and process.discarded
+    assert len(computer.policy) == 0 and computer.get_processes() == []
+    assert not computer.cancel(process.process_id)
+
+
+def test_cancel_running_process_stops_after_its_chunk(clock):
+    computer = Computer(1, clock=clock)
+    process = make_process(clock)
+    computer.add_process(process)
+    worker = computer.workers[0]
+    with computer.lock:
+        computer.schedule(worker)
+    computer.cancel(process.process_id)
+    assert not process.finished.is_set()
+    process.process()
+    with computer.lock:
+        computer.schedule(worker)
+    assert process.finished.is_set() and worker.current_process is None
+
+
+def test_pause_and_resume_queued_process(clock):
+    computer = Computer(1, clock=clock)
+    process = make_process(clock)
+    computer.add_process(process)
+    assert computer.pause(process.process_id)
+    assert not computer.pause(process.process_id)
+    worker = computer.workers[0]
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is None
+    assert computer.get_processes() == [process]
+    assert computer.resume(process.process_id)
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is process
+
+
+def test_paused_running_process_is_parked_after_its_chunk(clock):
+    computer = Computer(1, clock=clock)
+    paused, other = make_process(clock), make_process(clock)
+    computer.add_process(paused)
+    worker = computer.workers[0]
+    with computer.lock:
+        computer.schedule(worker)
+    computer.add_process(other)
+    computer.pause(paused.process_id)
+    paused.process()
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is other
+    assert paused.process_id in computer.paused
+    computer.resume(paused.process_id)
+    assert paused.process_id not in computer.paused
+    assert len(computer.policy) == 1
+
+
+def test_reprioritize_queued_process(clock):
+    computer = Computer(1, clock=clock, settings={"fair_share":False})
+    first, second = make_process(clock), make_process(clock)
+    computer.add_process(first)
+    computer.add_process(second)
+    assert computer.reprioritize(second.process_id, priority=1)
+    worker = computer.workers[0]
+    with computer.lock:
+        computer.schedule(worker)
+    assert worker.current_process is second
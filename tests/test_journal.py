@@ -0,0 +1,62 @@
+from journal import TransferJournal
+import json
+
+
+class Transfer:
+    def __init__(self, cloud_path:str, offset:int=0, user:str="a", journaled:bool=True):
+        self.cloud_path = cloud_path
+        self.offset = offset
+        self.user = user
+        self.journaled = journaled
+
+    def journal_entry(self) -> dict:
+        if (not self.journaled):
+            return None
+        return {"type":"upload", "user":self.user, "cloud_path":self.cloud_path, "offset":self.offset}
+
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "journal.json")
+    journal = TransferJournal(path)
+    transfer = Transfer("docs/a.txt", 262144)
+    journal.record(transfer)
+    journal.record(Transfer("docs/b.txt", user="b"))
+    journal.flush()
+
+    restarted = TransferJournal(path)
+    assert restarted.find("upload", "a", "docs/a.txt")["offset"] == 262144
+    assert [entry["cloud_path"] for entry in restarted.pending("b")] == ["docs/b.txt"]
+
+
+def test_record_refreshes_and_remove_forgets(tmp_path):
+    path = str(tmp_path / "journal.json")
+    journal = TransferJournal(path)
+    transfer = Transfer("a.txt")
+    journal.record(transfer)
+    transfer.offset = 524288
+    journal.record(transfer)
+    assert journal.find("upload", "a", "a.txt")["offset"] == 524288
+    journal.remove(transfer)
+    assert journal.find("upload", "a", "a.txt") is None
+    #Processes without an entry are not journaled
+    journal.record(Transfer("b.txt", journaled=False))
+    assert journal.pending("a") == []
+
+
+def test_checkpoint_waits_for_the_interval(tmp_path):
+    path = tmp_path / "journal.json"
+    journal = TransferJournal(str(path))
+    journal.interval = 3600
+    journal.record(Transfer("a.txt"))
+    journal.checkpoint()
+    assert not path.exists()
+    journal.interval = 0
+    journal.checkpoint()
+    assert list(json.loads(path.read_text())) == ["upload/a/a.txt"]
+    assert not journal.dirty
+
+
+def test_corrupt_journal_starts_empty(tmp_path):
+    path = tmp_path / "journal.json"
+    path.write_text("{not json")
+    assert TransferJournal(str(path)).pending("a") == []
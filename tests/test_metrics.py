@@ -0,0 +1,108 @@
+from metrics import Histogram, RollingHistogram, TransferStats, MetricsServer, render, format_labels, BYTES_TRANSFERRED
+from urllib.request import urlopen
+from urllib.error import HTTPError
+import random
+import pytest
+
+
+def test_percentiles_are_within_the_bucket_error():
+    rng = random.Random(0)
+    values = sorted(rng.lognormvariate(0, 2) for _ in range(10000))
+    histogram = Histogram(1e-3, 1e6)
+    for value in values:
+        histogram.record(value)
+    for q in [0.5, 0.9, 0.99]:
+        exact = values[int(q * len(values)) - 1]
+        assert abs(histogram.percentile(q) - exact) <= exact / histogram.sub_buckets
+    assert histogram.percentile(1) == values[-1]
+    assert histogram.count == len(values)
+    assert abs(histogram.mean() - sum(values) / len(values)) < 1e-6
+
+
+def test_empty_histogram_has_no_percentiles():
+    histogram = Histogram(1e-3, 1e6)
+    assert histogram.percentile(0.5) is None and histogram.mean() is None
+
+
+def test_rolling_window_forgets_old_intervals():
+    histogram = RollingHistogram(1e-3, 1e6, interval=60, slots=10)
+    histogram.record(1, now=0)
+    histogram.record(100, now=300)
+    assert histogram.snapshot(now=300, window=120).count == 1
+    assert histogram.snapshot(now=300).count == 2
+    #The slot of the first interval is reused ten intervals later
+    histogram.record(5, now=600)
+    assert histogram.snapshot(now=600, window=600).count == 2
+
+
+def test_transfer_stats_merge_by_type_and_priority():
+    stats = TransferStats()
+    stats.record("turnaround", "upload", 1, 2.0, now=0)
+    stats.record("turnaround", "upload", 3, 8.0, now=0)
+    stats.record("turnaround", "download", 1, 4.0, now=0)
+    assert stats.snapshot("turnaround", now=0).count == 3
+    assert stats.snapshot("turnaround", "upload", now=0).count == 2
+    assert stats.snapshot("turnaround", "upload", 3, now=0).count == 1
+    summary = stats.summary("turnaround", "upload", now=0)
+    assert summary["count"] == 2 and summary["mean"] == 5.0 and summary["max"] == 8.0
+
+
+class Policy:
+    name:str = "mlfq"
+
+    def depths(self) -> dict[str, int]:
+        return {"background/1":2, "interactive/1":0}
+
+
+class Process:
+    process_id:int = 7
+    process_type:str = "upload"
+    priority:int = 1
+
+
+class Worker:
+    worker_id:int = 0
+    current_process = Process()
+
+
+class Computer:
+    def __init__(self):
+        self.policy = Policy()
+        self.processes = {7:Process()}
+        self.settings = {"max_in_flight":64}
+        self.workers = [Worker()]
+        self.stats = TransferStats()
+        self.stats.record("turnaround", "upload", 1, 2.0)
+
+
+def test_label_values_are_escaped():
+    assert format_labels({"path":'a"b\\c\n'}) == '{path="a\\"b\\\\c\\n"}'
+    assert format_labels({}) == ""
+
+
+def test_render_exposes_the_computer():
+    BYTES_TRANSFERRED.inc(1024, process_type="test")
+    text = render(Computer())
+    lines = text.splitlines()
+    assert 'cloudos_queue_depth{policy="mlfq",queue="background/1"} 2' in lines
+    assert "cloudos_in_flight 1" in lines
+    assert "cloudos_max_in_flight 64" in lines
+    assert 'cloudos_current_process{worker="0",process_id="7",process_type="upload",priority="1"} 1' in lines
+    assert 'cloudos_turnaround_seconds_count{process_type="upload"} 1' in lines
+    assert any(line.startswith('cloudos_bytes_transferred_total{process_type="test"}') for line in lines)
+    assert "# TYPE cloudos_turnaround_seconds summary" in lines
+    assert text.endswith("\n")
+
+
+def test_server_serves_metrics_only():
+    server = MetricsServer(Computer(), 0)
+    server.start()
+    try:
+        port = server.httpd.server_address[1]
+        with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert b"cloudos_in_flight 1" in response.read()
+        with pytest.raises(HTTPError):
+            urlopen(f"http://127.0.0.1:{port}/other")
+    finally:
+        server.stop()
@@ -0,0 +1,186 @@
+from policies import FairSharePolicy, MLFQPolicy, FIFOPolicy, WeightedFairPolicy, EDFPolicy, POLICIES
+import logging
+
+SETTINGS = {
+    "aging_time":5,
+    "time_quantum":3,
+    "lower_priority_time":5,
+    "wfq_weights":{},
+    "default_deadline":60,
+    "background_share":0.2,
+    "user_weights":{},
+    "user_max_transfers":None,
+    "user_max_rate":None
+}
+
+
+class Computer:
+    logger = logging.getLogger("test")
+
+    def __init__(self, **settings):
+        self.settings = dict(SETTINGS, **settings)
+        self.now = 0.0
+
+    def clock(self) -> float:
+        return self.now
+
+
+class User:
+    def __init__(self, local_id:str):
+        self.localId = local_id
+
+
+class Job:
+    process_type:str = "upload"
+    priority:int = 3
+    sub_processed_time:int = 0
+    enqueued_time:float = 0
+    deadline:float = None
+    transferred:int = 0
+
+    def __init__(self, process_id:int, user:str="a", burst_time:int=1, qos:str="background", arrival_time:float=0):
+        self.process_id = process_id
+        self.user = User(user)
+        self.burst_time = burst_time
+        self.qos = qos
+        self.arrival_time = arrival_time
+
+    def waited(self, now:float) -> float:
+        return now - self.enqueued_time
+
+    def increase_priority(self):
+        self.priority = max(1, self.priority - 1)
+
+    def decrease_priority(self):
+        self.priority = min(3, self.priority + 1)
+
+
+class Worker:
+    worker_id:int = 0
+
+
+def run_to_end(policy, process, transferred:int):
+    #What Computer.schedule does with a process that completed in the chunk it just ran
+    process.transferred = transferred
+    policy.charge(process)
+    policy.finished(process)
+
+
+def test_single_chunk_transfers_are_charged_to_the_user_rate():
+    computer = Computer(user_max_rate=1000)
+    policy = FairSharePolicy(computer, MLFQPolicy)
+    first, second = Job(0), Job(1)
+    policy.add(first)
+    policy.add(second)
+    assert policy.select(Worker()) is first
+    run_to_end(policy, first, 5000)
+    #The user is in debt for the whole transfer, the next one waits until it is paid back
+    assert policy.select(Worker()) is None
+    assert policy.retry_after() == 4
+    computer.now = 4
+    assert policy.select(Worker()) is second
+
+
+def test_last_chunk_counts_towards_the_fair_share():
+    policy = FairSharePolicy(Computer(), MLFQPolicy)
+    jobs = [Job(0, "a"), Job(1, "b"), Job(2, "a"), Job(3, "b")]
+    for job in jobs:
+        policy.add(job)
+    first = policy.select(Worker())
+    run_to_end(policy, first, 1000)
+    #The user whose transfer just moved its bytes has to wait for the other one
+    assert policy.select(Worker()).user.localId != first.user.localId
+    assert policy.served[first.user.localId] == 1000
+
+
+def test_policies_are_registered_by_name():
+    assert set(POLICIES) == {"mlfq", "fifo", "wfq", "edf"}
+    assert all(POLICIES[name].name == name for name in POLICIES)
+
+
+def test_fifo_runs_in_arrival_order():
+    policy = FIFOPolicy(Computer())
+    jobs = [Job(0, burst_time=9), Job(1, burst_time=1), Job(2, burst_time=5)]
+    for job in jobs:
+        policy.add(job)
+    assert [policy.select(Worker()) for _ in jobs] == jobs
+    assert not policy.should_preempt(jobs[0])
+
+
+def test_wfq_splits_chunks_by_weight():
+    policy = WeightedFairPolicy(Computer(wfq_weights={"download":2}))
+    upload, download = Job(0), Job(1)
+    download.process_type = "download"
+    policy.add(upload)
+    policy.add(download)
+    ran = []
+    for _ in range(6):
+        process = policy.select(Worker())
+        ran.append(process.process_type)
+        policy.charge(process)
+        policy.requeue(process)
+    assert ran.count("download") == 4 and ran.count("upload") == 2
+
+
+def test_edf_runs_the_earliest_deadline_and_preempts_for_it():
+    policy = EDFPolicy(Computer(default_deadline=60))
+    late = Job(0, arrival_time=0)
+    urgent = Job(1, arrival_time=10)
+    urgent.deadline = 5
+    policy.add(late)
+    policy.add(urgent)
+    assert policy.select(Worker()) is urgent
+    assert policy.select(Worker()) is late
+    #A process without a deadline gets arrival_time + default_deadline
+    assert policy.deadline(late) == 60
+    policy.add(urgent)
+    assert policy.should_preempt(late)
+
+
+def test_drain_empties_the_policy():
+    policy = MLFQPolicy(Computer())
+    jobs = [Job(0), Job(1, qos="interactive")]
+    for job in jobs:
+        policy.add(job)
+    assert sorted(job.process_id for job in policy.drain()) == [0, 1]
+    assert len(policy) == 0
+
+
+def test_interactive_runs_first_and_preempts_background():
+    policy = MLFQPolicy(Computer())
+    background, interactive = Job(0), Job(1, qos="interactive")
+    policy.add(background)
+    assert policy.select(Worker()) is background
+    policy.add(interactive)
+    assert policy.should_preempt(background)
+    policy.requeue(background)
+    assert policy.select(Worker()) is interactive
+
+
+def test_background_gets_its_share_behind_interactive_work():
+    policy = MLFQPolicy(Computer(background_share=0.2))
+    policy.add(Job(0))
+    for process_id in range(1, 4):
+        policy.add(Job(process_id, qos="interactive"))
+    ran = []
+    for _ in range(10):
+        process = policy.select(Worker())
+        ran.append(process.qos)
+        process.transferred += 1000
+        policy.charge(process)
+        policy.requeue(process)
+    assert ran.count("background") == 2
+    assert policy.served == {"interactive":8000, "background":2000}
+
+
+def test_idle_class_is_not_owed_its_share():
+    policy = MLFQPolicy(Computer(background_share=0.5))
+    interactive = Job(0, qos="interactive")
+    policy.add(interactive)
+    policy.select(Worker())
+    run_to_end(policy, interactive, 5000)
+    #Background work arriving after the interactive class went idle starts the shares over
+    policy.add(Job(1))
+    policy.add(Job(2, qos="interactive"))
+    assert policy.served == {"interactive":0, "background":0}
+    assert policy.select(Worker()).qos == "interactive"
@@ -0,0 +1,56 @@
+from queues import FIFOQueue, HeapQueue
+
+
+class Job:
+    def __init__(self, process_id:int, key:int):
+        self.process_id = process_id
+        self.key = key
+
+
+def test_fifo_order_and_remove():
+    queue = FIFOQueue()
+    jobs = [Job(i, 0) for i in range(3)]
+    for job in jobs:
+        queue.push(job)
+    queue.remove(jobs[0])
+    assert len(queue) == 2 and jobs[0] not in queue
+    assert queue.oldest() is jobs[1]
+    assert [queue.pop(), queue.pop(), queue.pop()] == [jobs[1], jobs[2], None]
+
+
+def test_heap_pops_by_key_then_arrival():
+    queue = HeapQueue(lambda job: job.key)
+    jobs = [Job(0, 5), Job(1, 1), Job(2, 5), Job(3, 3)]
+    for job in jobs:
+        queue.push(job)
+    assert queue.peek() is jobs[1]
+    assert [queue.pop() for _ in jobs] == [jobs[1], jobs[3], jobs[0], jobs[2]]
+    assert queue.pop() is None and not queue
+
+
+def test_heap_update_rekeys():
+    queue = HeapQueue(lambda job: job.key)
+    jobs = [Job(0, 1), Job(1, 2)]
+    for job in jobs:
+        queue.push(job)
+    jobs[0].key = 3
+    queue.update(jobs[0])
+    assert len(queue) == 2
+    assert [queue.pop(), queue.pop()] == [jobs[1], jobs[0]]
+
+
+def test_heap_age_order_survives_rekey_and_remove():
+    queue = HeapQueue(lambda job: job.key)
+    jobs = [Job(i, 10 - i) for i in range(3)]
+    for job in jobs:
+        queue.push(job)
+    jobs[0].key = 0
+    queue.update(jobs[0])
+    assert queue.oldest() is jobs[0]
+    queue.remove(jobs[0])
+    assert queue.oldest() is jobs[1]
+    assert queue.pop() is jobs[2]
+    assert queue.oldest() is jobs[1]
+    #Pushing again puts it behind the ones still waiting
+    queue.push(jobs[2])
+    assert queue.oldest() is jobs[1]
@@ -0,0 +1,51 @@
+from ratelimit import TokenBucket, BandwidthLimiter
+import pytest
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bucket_refills_up_to_burst():
+    clock = Clock()
+    bucket = TokenBucket(100, 200, clock)
+    bucket.consume(200)
+    assert bucket.available() == 0
+    clock.now = 1
+    assert bucket.available() == 100
+    clock.now = 10
+    assert bucket.available() == 200
+
+
+def test_bucket_debt_delays_the_next_transfer():
+    clock = Clock()
+    bucket = TokenBucket(100, 100, clock)
+    assert bucket.delay(100) == 0
+    bucket.consume(300)
+    assert bucket.delay() == pytest.approx(2)
+    clock.now = 2
+    assert bucket.delay() == 0
+
+
+def test_grant_shrinks_to_what_the_bucket_holds():
+    limiter = BandwidthLimiter()
+    assert limiter.grant("upload", 1000, 10) == 1000
+    limiter.set_rate("upload", 500)
+    bucket = limiter.buckets["upload"]
+    bucket.clock = Clock()
+    bucket.updated = 0
+    assert limiter.grant("upload", 1000, 10, 64) == 448
+    limiter.consume("upload", 500)
+    #An empty bucket still grants the minimum so the transfer makes progress
+    assert limiter.grant("upload", 1000, 128, 64) == 128
+    limiter.set_rate("upload", None)
+    assert limiter.grant("upload", 1000, 10) == 1000
+
+
+def test_unknown_direction():
+    with pytest.raises(ValueError):
+        BandwidthLimiter().set_rate("sideways", 100)
@@ -0,0 +1,21 @@
+from sessions import SessionPool
+import requests
+
+
+def test_one_adapter_per_host_with_retries():
+    pool = SessionPool(pool_maxsize=4)
+    session = pool.session("https://storage.googleapis.com/upload/a")
+    adapter = session.get_adapter("https://storage.googleapis.com/b")
+    assert adapter is pool.adapter("https://storage.googleapis.com/c")
+    assert adapter.max_retries.total == 3
+    assert pool.session("https://storage.googleapis.com/d") is session
+
+
+def test_mounted_session_shares_the_adapter_and_keeps_retries():
+    pool = SessionPool()
+    session = requests.Session()
+    pool.mount(session, "https://example.firebaseio.com")
+    assert session.get_adapter("https://example.firebaseio.com/users.json") is pool.adapter("https://example.firebaseio.com")
+    pool.configure(8)
+    adapter = session.get_adapter("https://example.firebaseio.com/users.json")
+    assert adapter._pool_maxsize == 8 and adapter.max_retries.total == 3